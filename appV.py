@@ -4,97 +4,86 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import hashlib
-from io import BytesIO
+import os
+import uuid
+from pathlib import Path
+from functools import partial
 import datetime as dt
 from dateutil.relativedelta import relativedelta
 import warnings
 import numpy as np
+from fleet_core import (format_date_fr, pre_format_columns, REQUIRED_SHEETS,
+                        load_workbooks, consolidate_workbooks, combine_hashes, data_date_range,
+                        acquire_dataset, release_dataset,
+                        build_vehicle_index, select_vehicle_rows, compute_vehicle_kpis, build_resume,
+                        build_vehicle_report, build_reports_zip, report_file_name,
+                        build_cost_cube, cube_for_vehicle, slice_cube, cube_totals,
+                        SERIES_FREQS, SERIES_WEBGL_POINTS, daily_series, choose_series_freq, resample_series,
+                        build_fuel_efficiency, fleet_efficiency_ranking,
+                        build_compliance_index, compliance_alerts, compute_fleet_kpis)
+from fleet_export import EXPORT_FORMATS, EXPORT_MIME, memory_chunks, export_dataset, export_file_name
+from fleet_sqlite import (build_sqlite_store, read_table, sheet_row_counts, query_vehicle_frames, query_cube,
+                          query_cube_summary, query_compliance_index, query_efficiency_ranking, query_batch,
+                          query_fleet_kpis, query_date_range, sqlite_chunks)
+from fleet_perf import start_trace, finish_trace, append_trace, stage, timed, count_calls, count_miss, TRACE_FILE
 warnings.filterwarnings('ignore')
 
-# Fonction pour formater les dates en français
-def format_date_fr(date):
-    if pd.isna(date) or date is None:
-        return ""
-    if isinstance(date, str):
-        date = pd.to_datetime(date)
-    months = {
-        1: 'janvier', 2: 'février', 3: 'mars', 4: 'avril',
-        5: 'mai', 6: 'juin', 7: 'juillet', 8: 'août',
-        9: 'septembre', 10: 'octobre', 11: 'novembre', 12: 'décembre'
-    }
-    return f"{date.day} {months[date.month]} {date.year}"
+# Stockage des données : "memoire" (feuilles en DataFrames) ou "sqlite" (base locale indexée, seules les lignes
+# et agrégats affichés sont relus ; mémoire bornée quelle que soit la profondeur de l'historique)
+STOCKAGE_SQLITE = os.environ.get("SUIVI_STOCKAGE", "memoire") == "sqlite"
+
+# Pré-formatage instrumenté : compté dans l'étape "formatage" du panneau de performance
+pre_format_columns = timed("formatage")(pre_format_columns)
 
 # Fonction pour hasher le fichier pour le cache
+@count_calls("get_file_hash")
 @st.cache_data
 def get_file_hash(uploaded_file):
+    count_miss("get_file_hash")
     return hashlib.md5(uploaded_file.read()).hexdigest()
 
-# Charger et nettoyer les données (FIX pour Quantité : forcer en float)
-@st.cache_data
-def load_and_clean_data(file_hash, file_bytes):
+# Feuilles consolidées des classeurs chargés (le plus récent, d'après les dates des feuilles, l'emporte) :
+# un classeur déjà vu est relu depuis le cache disque, seuls les nouveaux sont analysés (en parallèle)
+def read_uploaded_workbooks(file_hashes, uploaded_files):
+    files = [(file_hash, uploaded_file.getvalue) for file_hash, uploaded_file in zip(file_hashes, uploaded_files)]
+    return consolidate_workbooks(load_workbooks(files))
+
+# Charger et nettoyer les données (FIX pour Quantité : forcer en float) : un seul exemplaire partagé par toutes
+# les sessions qui utilisent ces classeurs (pas de copie sérialisée par session comme avec st.cache_data) ;
+# les classeurs précédents de la session sont libérés
+@count_calls("load_and_clean_data")
+def load_and_clean_data(file_hash, file_hashes, uploaded_files, session_id):
+    def load():
+        count_miss("load_and_clean_data")
+        return read_uploaded_workbooks(file_hashes, uploaded_files)
     try:
-        xls = pd.ExcelFile(BytesIO(file_bytes))
-        data = {}
-        for sheet in xls.sheet_names:
-            df = pd.read_excel(BytesIO(file_bytes), sheet_name=sheet)
-            # Nettoyage : Supprimer lignes vides
-            df = df.dropna(how='all')  # Supprimer lignes entièrement vides
-            
-            # Détecter et convertir dates Excel (seulement sur colonnes int64)
-            int_df = df.select_dtypes(include=['int64'])
-            if not int_df.empty:
-                unique_counts = int_df.nunique()  # nunique SEULEMENT sur les int64 (taille correcte)
-                date_mask = unique_counts < len(df)  # Masque booléen de la bonne taille
-                date_cols = int_df.columns[date_mask].tolist()  # Colonnes potentielles dates
-                for col in date_cols:
-                    if not (sheet == "Achats" and col == "Quantité") and "Année" not in col:
-                        df[col] = pd.to_datetime(df[col], unit='D', origin='1899-12-30', errors='coerce')
-            else:
-                date_cols = []  # Pas de colonnes à convertir
-            
-            # Nettoyage supplémentaire : Remplacer NaN par 0 dans colonnes numériques
-            numeric_cols = df.select_dtypes(include=[np.number]).columns
-            df[numeric_cols] = df[numeric_cols].fillna(0)
-            
-            # FIX SPÉCIFIQUE : Forcer "Quantité" en float dans Achats (éviter confusion date/nombre)
-            if sheet == "Achats" and "Quantité" in df.columns:
-                # Forcer Quantité comme numérique AVANT toute détection de date
-                df["Quantité"] = pd.to_numeric(df["Quantité"], errors="coerce")
-                df["Quantité"] = df["Quantité"].fillna(0)
-                # Valeurs négatives ou absurdes -> valeur absolue
-                df["Quantité"] = df["Quantité"].abs()
-            
-            data[sheet] = df
-        return data
+        return acquire_dataset(file_hash, load, owner=session_id)
+    except Exception as e:
+        st.error(f"Erreur lors du chargement : {e}. Vérifiez le format Excel.")
+        return {}, {}
+
+# Mode SQLite : base construite une fois par jeu de classeurs (fichier partagé par tous les workers) ; vérifiée
+# à chaque exécution, car le cache disque peut l'évincer (elle est alors reconstruite)
+@count_calls("get_sqlite_store")
+def get_sqlite_store(file_hash, file_hashes, uploaded_files):
+    def load():
+        count_miss("get_sqlite_store")
+        return read_uploaded_workbooks(file_hashes, uploaded_files)[0]
+    try:
+        return build_sqlite_store(file_hash, load)
     except Exception as e:
         st.error(f"Erreur lors du chargement : {e}. Vérifiez le format Excel.")
-        return {}
+        return None
 
-# Fonction utilitaire pour pré-formater colonnes avec espaces (pour tableaux)
-def pre_format_columns(df, money_cols, quantity_cols):
-    df_formatted = df.copy()
-    for col in money_cols:
-        if col in df.columns:
-            df_formatted[col] = df_formatted[col].apply(lambda x: f"{x:,.0f}".replace(",", " ") + " Ar")
-    for col in quantity_cols:
-        if col in df.columns:
-            if col == "Litres":
-                df_formatted[col] = df_formatted[col].apply(lambda x: f"{x:.1f} L")
-            elif col == "Kilométrage":
-                df_formatted[col] = df_formatted[col].apply(lambda x: f"{x:,.0f}".replace(",", " ") + " km")
-            elif col == "Km_Parcourus":
-                df_formatted[col] = df_formatted[col].apply(lambda x: f"{x:,.0f}".replace(",", " ") + " km")
-            elif col == "Quantité":
-                df_formatted[col] = df_formatted[col].apply(lambda x: f"{x:.1f}")
-            else:
-                df_formatted[col] = df_formatted[col].apply(lambda x: f"{x:.0f}")
-    
-    # Formatage des colonnes dates
-    date_cols = df_formatted.select_dtypes(include=['datetime64[ns]']).columns
-    for col in date_cols:
-        df_formatted[col] = df_formatted[col].apply(format_date_fr)
-    
-    return df_formatted
+# Feuilles de référence (une ligne par véhicule / fournisseur) relues une fois depuis la base SQLite
+@st.cache_resource(max_entries=8)
+def get_sqlite_sheet(file_hash, sheet, _db):
+    return read_table(_db, sheet)
+
+# Partagé entre les reruns : l'index ne dépend que du contenu du classeur (file_hash)
+@st.cache_resource(max_entries=4)
+def get_vehicle_index(file_hash, _dfs):
+    return build_vehicle_index(_dfs)
 
 # Fonction utilitaire pour formater les colonnes monétaires avec "Ar" (espace comme séparateur)
 def format_money_columns(df, money_cols):
@@ -112,170 +101,220 @@ def format_liters_columns(df, liter_cols):
             config[col] = st.column_config.NumberColumn(label=col, format="%.1f L")
     return config
 
-# Configuration de la page
-st.set_page_config(page_title="Suivi des Véhicules OMNIS ", layout="wide", initial_sidebar_state="expanded")
-st.title("🚗📊 Suivi des Véhicules OMNIS ")
-
-# Sidebar pour filtres globaux
-st.sidebar.header("🔧 Filtres Globaux")
-uploaded_file = st.sidebar.file_uploader("📁 Charger un fichier Excel", type=["xlsx"])
-
-if uploaded_file:
-    with st.spinner("Chargement des données..."):
-        file_hash = get_file_hash(uploaded_file)
-        data = load_and_clean_data(file_hash, uploaded_file.getvalue())
-    
-    if not data:
-        st.error("Impossible de charger les données. Veuillez vérifier le fichier.")
-        st.stop()
-    
-    st.sidebar.success("✅ Données chargées")
-    
-    # Stats de chargement (bonus)
-    with st.sidebar.expander("📈 Statistiques Chargement"):
-        for sheet, df in data.items():
-            st.write(f"{sheet}: {len(df)} lignes")
-
-    # Récupérer les DataFrames avec gestion d'erreurs (AJOUT "Carburant")
-    required_sheets = ["Parc_Véhicules", "Entretien", "Réparations Internes", "Prestation externe", 
-                       "Suivi_Kilométrage", "Garage", "Fournisseurs", "Achats", "Assurance", "Visite_Technique", "Carburant"]
-    dfs = {}
-    for sheet in required_sheets:
-        if sheet in data:
-            dfs[sheet] = data[sheet]
-        else:
-            st.error(f"Feuille '{sheet}' manquante. est manquante. Veuillez utiliser le fichier Excel .")
-            st.stop()
-
-    df_vehicules = dfs["Parc_Véhicules"]
-    directions = sorted(df_vehicules["Direction"].dropna().unique())
-    selected_directions = st.sidebar.multiselect("🏢 Directions", options=directions, default=directions)
-    date_start, date_end = st.sidebar.date_input("📅 Période", value=(dt.date(2024, 1, 1), dt.date(2026, 1, 18)))
-
-    df_vehicules_filtered = df_vehicules[df_vehicules["Direction"].isin(selected_directions)]
-    if df_vehicules_filtered.empty:
-        st.warning("Aucune direction valide sélectionnée.")
-        st.stop()
-
-    # Sélection véhicule
-    selected_vehicle = st.selectbox("🚗 Sélection du véhicule", options=df_vehicules_filtered["Immatriculation"].unique())
-
-    # Infos véhicule filtrées
-    vehicule_info = df_vehicules_filtered[df_vehicules_filtered["Immatriculation"] == selected_vehicle].iloc[0]
-    df_vehicle_specific = {}
-    for k, v in dfs.items():
-        if "Immatriculation" in v.columns:
-            df_vehicle_specific[k] = v[v["Immatriculation"] == selected_vehicle]
-
-    # Dashboard Global en haut (KPIs en 2 lignes, unité Km ajoutée, format espace, SUPPRIMÉ deltas)
-    # Ligne 1 : 4 KPIs
-    col1, col2, col3, col4 = st.columns(4)
-    with col1:
-        df_km = df_vehicle_specific.get("Suivi_Kilométrage", pd.DataFrame())
-        dernier_km = df_km.sort_values("Date", ascending=False)["Kilométrage"].iloc[0] if not df_km.empty else 0
-        st.metric("📏 Kilométrage", f"{int(dernier_km):,}".replace(",", " ") + " km")
-    with col2:
-        total_entretien = df_vehicle_specific.get("Entretien", pd.DataFrame())["Coût_Total"].sum()
-        st.metric("🛠 Coût d’entretien", f"{total_entretien:,.0f}".replace(",", " ") + " Ar")
-    with col3:
-        total_reparations = (df_vehicle_specific.get("Réparations Internes", pd.DataFrame())["Coût_Total"].sum() + 
-                             df_vehicle_specific.get("Prestation externe", pd.DataFrame())["Coût_Total"].sum())
-        st.metric("🔧 Coût des réparations", f"{total_reparations:,.0f}".replace(",", " ") + " Ar")
-    with col4:
-        total_achats = df_vehicle_specific.get("Achats", pd.DataFrame())["Prix_Total"].sum()
-        st.metric("🛒 Coûts totaux des achats de pièces", f"{total_achats:,.0f}".replace(",", " ") + " Ar")
-    
-    # Ligne 2 : 3 KPIs
-    col5, col6, col7 = st.columns(3)
-    with col5:
-        cout_total_veh = total_entretien + total_reparations + total_achats
-        st.metric("💰 Coûts totaux d’entretien et de réparation", f"{cout_total_veh:,.0f}".replace(",", " ") + " Ar")
-    with col6:
-        df_carbu = df_vehicle_specific.get("Carburant", pd.DataFrame())
-        total_litres = df_carbu["Litres"].sum()
-        st.metric("⛽ Consommation totale de carburant (L)", f"{total_litres:,.1f}".replace(",", " ") + " L")
-    with col7:
-        total_carbu_ar = df_carbu["Total_Ar"].sum()
-        st.metric("⛽ Coûts de consommation de carburant", f"{total_carbu_ar:,.0f}".replace(",", " ") + " Ar")
-
-    # Alertes (ex. : assurances expirées)
-    today = pd.to_datetime(dt.date.today())  # Convertir en datetime64[ns] pour compatibilité pandas
-    df_ass = df_vehicle_specific.get("Assurance", pd.DataFrame())
-    if not df_ass.empty and "Date_Fin" in df_ass.columns:
-        # Normaliser les dates pour ignorer l'heure
-        df_ass["Date_Fin"] = pd.to_datetime(df_ass["Date_Fin"]).dt.normalize()
-        ass_exp = df_ass[df_ass["Date_Fin"] < today]
-        if not ass_exp.empty:
-            st.error(f"⚠️ {len(ass_exp)} assurance(s) expirée(s) pour {selected_vehicle} !")
-
-    df_vt = df_vehicle_specific.get("Visite_Technique", pd.DataFrame())
-    if not df_vt.empty and "Etat" in df_vt.columns:
-        vt_exp = df_vt[df_vt["Etat"] == "Expiré"]
-        if not vt_exp.empty:
-            st.warning(f"🔍 {len(vt_exp)} visite(s) technique(s) à renouveler.")
-
-    # Onglets améliorés (AJOUT onglet "⛽ Carburant")
-    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
-        "📋 Fiche Véhicule", "🛠 Entretien & Réparations",
-        "📈 Kilométrage et Performances", "📋 Assurance et visites techniques",
-        "🛒 Achats & Fournisseurs", "⛽ Carburant", "📊 Tableau de bord global & Export"
-    ])
-
-    with tab1:
-        st.subheader(f"📌 Détails : {selected_vehicle}")
-        # Appliquer formatage pour les dates et potentiellement monétaires
-        money_cols_veh = ["Prix_Achat"] if "Prix_Achat" in vehicule_info.index else []
-        quantity_cols_veh = []
-        veh_df_formatted = pre_format_columns(vehicule_info.to_frame().T, money_cols_veh, quantity_cols_veh)
-        st.dataframe(veh_df_formatted, use_container_width=True)
-
-    with tab2:
-        # Entretien
-        st.subheader("🛠 Entretien")
-        df_e = df_vehicle_specific.get("Entretien", pd.DataFrame())
-        if df_e.empty:
-            st.info("Aucune opération d’entretien enregistrée.")
-        else:
-            df_e_formatted = pre_format_columns(df_e, ["Coût_Total"], [])
-            st.dataframe(df_e_formatted, use_container_width=True)
-            if 'Type_Entretien' in df_e.columns and 'Coût_Total' in df_e.columns:
-                fig = px.pie(df_e, names='Type_Entretien', values='Coût_Total', title='Répartition des coûts d’entretien (Ar)')
-                fig.update_traces(textinfo='label+percent+value', texttemplate='%{label}<br>%{percent}<br>%{value} Ar')
-                st.plotly_chart(fig, use_container_width=True)
-
-        # Réparations Internes
-        st.subheader("🔧 Réparations Internes")
-        df_ri = df_vehicle_specific.get("Réparations Internes", pd.DataFrame())
-        if df_ri.empty:
-            st.info("Aucune réparation interne enregistrée.")
-        else:
-            df_ri_formatted = pre_format_columns(df_ri, ["Coût_Total"], [])
-            st.dataframe(df_ri_formatted, use_container_width=True)
-            if 'Date d_entrée à Andraharo' in df_ri.columns and 'Coût_Total' in df_ri.columns:
-                fig_ri = px.bar(df_ri, x='Date d_entrée à Andraharo', y='Coût_Total', color='Panne', 
-                                title='Évolution des coûts des réparations internes (Ar)')
-                fig_ri.update_yaxes(title_text="Coût (Ar)")
-                st.plotly_chart(fig_ri, use_container_width=True)
-
-        # Prestations Externes
-        st.subheader("🌐 Prestations Externes")
-        df_pe = df_vehicle_specific.get("Prestation externe", pd.DataFrame())
-        if df_pe.empty:
-            st.info("Aucune prestation externe enregistrée.")
-        else:
-            df_pe_formatted = pre_format_columns(df_pe, ["Coût_Total"], [])
-            st.dataframe(df_pe_formatted, use_container_width=True)
-            if 'Type de Prestation' in df_pe.columns and 'Coût_Total' in df_pe.columns:
-                fig_pe = px.pie(df_pe, names='Type de Prestation', values='Coût_Total', title='Répartition Prestations (Ar)')
-                fig_pe.update_traces(textinfo='label+percent+value', texttemplate='%{label}<br>%{percent}<br>%{value} Ar')
-                st.plotly_chart(fig_pe, use_container_width=True)
-
-    with tab3:
-     st.subheader("📈 Suivi du kilométrage")  # CHANGÉ EN BAR CHART
-     df_km = df_vehicle_specific.get("Suivi_Kilométrage", pd.DataFrame())
-     if df_km.empty:
+# Tableau prêt à afficher : les colonnes dont le rendu st.column_config est identique (litres) restent
+# numériques, les autres sont pré-formatées en bloc par pre_format_columns
+def display_table(df, money_cols, quantity_cols):
+    liter_cols = [col for col in quantity_cols if col == "Litres"]
+    other_cols = [col for col in quantity_cols if col not in liter_cols]
+    df_formatted = pre_format_columns(df, money_cols, other_cols)
+    return df_formatted, format_liters_columns(df_formatted, liter_cols)
+
+# Première et dernière opération du jeu de données (`_load_range()` : data_date_range ou query_date_range)
+@st.cache_resource(max_entries=4)
+def get_date_range(file_hash, _load_range):
+    return _load_range()
+
+# Cube de coûts agrégé, construit une fois par classeur et partagé entre les reruns
+@st.cache_resource(max_entries=4)
+def get_cost_cube(file_hash, _dfs):
+    return build_cost_cube(_dfs)
+
+# Consommation (L/100 km, Ar/km) de tous les pleins de la flotte, calculée une fois par classeur
+@st.cache_resource(max_entries=4)
+def get_fuel_efficiency(file_hash, _dfs):
+    return build_fuel_efficiency(_dfs)
+
+# Index des échéances d'assurance et visites expirées de toute la flotte, construit une fois par classeur
+@st.cache_resource(max_entries=4)
+def get_compliance_index(file_hash, _dfs):
+    return build_compliance_index(_dfs)
+
+# KPIs de tous les véhicules des Directions sur la période, en une passe groupée par feuille ; `_load_kpis()`
+# les calcule (compute_fleet_kpis ou query_fleet_kpis selon le stockage)
+@count_calls("get_fleet_kpis")
+@st.cache_data(max_entries=8)
+def get_fleet_kpis(file_hash, period, directions, _load_kpis):
+    count_miss("get_fleet_kpis")
+    return _load_kpis()
+
+# Rapport Excel d'un véhicule, construit à la demande et mis en cache par (classeur, véhicule, date, période)
+@st.cache_data(max_entries=32)
+def get_vehicle_report(file_hash, vehicle, today, period, _vehicle_frames, _vehicle_cube, _df_vehicules):
+    with stage("export Excel"):
+        return build_vehicle_report(vehicle, _vehicle_frames, _vehicle_cube, _df_vehicules, today, period)
+
+# Lignes de chaque véhicule d'un lot et cube de la période, depuis les DataFrames en mémoire
+def batch_from_memory(dfs, vehicle_index, cube, vehicles):
+    return {vehicle: select_vehicle_rows(dfs, vehicle_index, vehicle) for vehicle in vehicles}, cube
+
+# Archive zip des rapports d'une Direction ou de toute la flotte ; `_load_batch(vehicles)` fournit les lignes
+# des véhicules et le cube (batch_from_memory ou query_batch selon le stockage)
+@st.cache_data(max_entries=2)
+def get_reports_zip(file_hash, scope, today, period, _load_batch, _df_vehicules):
+    if scope != "Toute la flotte":
+        df_vehicules_scope = _df_vehicules[_df_vehicules["Direction"] == scope]
+    else:
+        df_vehicules_scope = _df_vehicules
+    frames, cube = _load_batch(df_vehicules_scope["Immatriculation"].dropna().unique())
+    with stage("export Excel"):
+        return build_reports_zip(frames, cube, _df_vehicules, today, period)
+
+# Graphiques Plotly : chaque figure est construite une fois par (classeur, véhicule, graphique, paramètres)
+# puis réutilisée telle quelle lors des changements d'onglet ou de véhicule
+def _pie_figure(df, names, values, title):
+    fig = px.pie(df, names=names, values=values, title=title)
+    fig.update_traces(textinfo='label+percent+value', texttemplate='%{label}<br>%{percent}<br>%{value} Ar')
+    return fig
+
+def build_fig_entretien(df_e):
+    return _pie_figure(df_e, 'Type_Entretien', 'Coût_Total', 'Répartition des coûts d’entretien (Ar)')
+
+def build_fig_reparations(df_ri):
+    fig_ri = px.bar(df_ri, x='Date d_entrée à Andraharo', y='Coût_Total', color='Panne', 
+                    title='Évolution des coûts des réparations internes (Ar)')
+    fig_ri.update_yaxes(title_text="Coût (Ar)")
+    return fig_ri
+
+def build_fig_prestations(df_pe):
+    return _pie_figure(df_pe, 'Type de Prestation', 'Coût_Total', 'Répartition Prestations (Ar)')
+
+# Série regroupée par jour / semaine / mois : barres SVG, ou ligne WebGL (Scattergl) au-delà de SERIES_WEBGL_POINTS
+def _series_figure(df, y, title, color=None):
+    if len(df) > SERIES_WEBGL_POINTS:
+        return px.line(df, x='Date', y=y, color=color, title=title, markers=True, render_mode='webgl')
+    return px.bar(df, x='Date', y=y, color=color, title=title)
+
+def build_fig_kilometrage(df_km):
+    # Bar chart avec km parcourus
+    fig_km = _series_figure(df_km, 'Km_Parcourus', 'Évolution des kilomètres parcourus')
+    fig_km.update_yaxes(title_text="Km Parcourus entre Dates")
+    return fig_km
+
+def build_fig_achats(df_ach):
+    return _pie_figure(df_ach, 'Nom_du_fournisseur', 'Prix_Total', 'Achats par Fournisseur (Ar)')
+
+def build_fig_litres(df_carbu):
+    fig_litres = _series_figure(df_carbu, 'Litres', 'Évolution de la consommation de carburant (L)', color='Type_Carburant')
+    fig_litres.update_yaxes(title_text="Litres (L)")
+    return fig_litres
+
+def build_fig_directions(df_coûts_dir):
+    fig_global = px.bar(df_coûts_dir, x="Direction", y="Montant", color="Catégorie",
+                        title="Coûts totaux par Direction et par catégorie (Ar)")
+    fig_global.update_yaxes(title_text="Coût (Ar)")
+    return fig_global
+
+def build_fig_carbu_type(df_carbu_global):
+    return _pie_figure(df_carbu_global, 'Type_Carburant', 'Montant', 'Répartition Coûts Carburant par Type (Ar)')
+
+FIGURE_BUILDERS = {
+    "entretien": build_fig_entretien,
+    "reparations": build_fig_reparations,
+    "prestations": build_fig_prestations,
+    "kilometrage": build_fig_kilometrage,
+    "achats": build_fig_achats,
+    "litres": build_fig_litres,
+    "directions": build_fig_directions,
+    "carbu_type": build_fig_carbu_type,
+}
+
+# Les figures ne sont jamais modifiées après construction : partagées sans copie (cache_resource)
+@count_calls("get_figure")
+@st.cache_resource(max_entries=256)
+def get_figure(file_hash, vehicle, chart, params, _df):
+    count_miss("get_figure")
+    return FIGURE_BUILDERS[chart](_df)
+
+# Affichage d'un graphique en cache ; la sérialisation par st.plotly_chart est comptée avec la construction
+def show_figure(file_hash, vehicle, chart, params, df):
+    with stage("graphiques"):
+        st.plotly_chart(get_figure(file_hash, vehicle, chart, params, df), use_container_width=True)
+
+# Sommes quotidiennes d'un véhicule pour un graphique temporel, calculées une fois par (classeur, véhicule)
+@count_calls("get_daily_series")
+@st.cache_resource(max_entries=64)
+def get_daily_series(file_hash, vehicle, chart, _df, value_col, by=None):
+    count_miss("get_daily_series")
+    return daily_series(_df, value_col, by)
+
+# Graphique temporel regroupé : plage affichée et granularité choisies par l'utilisateur ("Auto" : la plus fine
+# qui reste sous SERIES_MAX_POINTS intervalles) ; la figure est en cache par (véhicule, granularité, plage)
+def show_series_figure(file_hash, vehicle, chart, df, value_col, by=None):
+    daily = get_daily_series(file_hash, vehicle, chart, df, value_col, by)
+    if daily.empty:
+        return
+    first, last = daily["Date"].min().date(), daily["Date"].max().date()
+    col_plage, col_freq = st.columns([3, 1])
+    if first < last:
+        start, end = col_plage.slider("Plage affichée", min_value=first, max_value=last, value=(first, last),
+                                      format="DD/MM/YYYY", key=f"plage_{chart}_{vehicle}")
+    else:
+        start, end = first, last
+    freq = col_freq.selectbox("Regroupement", ["Auto", *SERIES_FREQS], format_func=lambda f: SERIES_FREQS.get(f, f),
+                              key=f"regroupement_{chart}")
+    if freq == "Auto":
+        freq = choose_series_freq(start, end)
+    series = resample_series(daily, freq, start, end)
+    show_figure(file_hash, vehicle, chart, (freq, start, end), series)
+    st.caption(f"{len(series)} point(s), regroupés par {SERIES_FREQS[freq].lower()}")
+
+ONGLETS = ["📋 Fiche Véhicule", "🛠 Entretien & Réparations",
+           "📈 Kilométrage et Performances", "📋 Assurance et visites techniques",
+           "🛒 Achats & Fournisseurs", "⛽ Carburant", "🏆 Comparatif flotte", "📊 Tableau de bord global & Export"]
+
+# Contenu des onglets : un fragment par onglet, appelé uniquement pour l'onglet affiché et relancé seul
+# quand un de ses widgets change
+@st.fragment
+def render_fiche_vehicule(vehicle, vehicule_info):
+    st.subheader(f"📌 Détails : {vehicle}")
+    # Appliquer formatage pour les dates et potentiellement monétaires
+    money_cols_veh = ["Prix_Achat"] if "Prix_Achat" in vehicule_info.index else []
+    quantity_cols_veh = []
+    veh_df_formatted = pre_format_columns(vehicule_info.to_frame().T, money_cols_veh, quantity_cols_veh)
+    st.dataframe(veh_df_formatted, use_container_width=True)
+
+@st.fragment
+def render_entretien(file_hash, vehicle, vehicle_frames):
+    # Entretien
+    st.subheader("🛠 Entretien")
+    df_e = vehicle_frames.get("Entretien", pd.DataFrame())
+    if df_e.empty:
+        st.info("Aucune opération d’entretien enregistrée.")
+    else:
+        df_e_formatted = pre_format_columns(df_e, ["Coût_Total"], [])
+        st.dataframe(df_e_formatted, use_container_width=True)
+        if 'Type_Entretien' in df_e.columns and 'Coût_Total' in df_e.columns:
+            show_figure(file_hash, vehicle, "entretien", None, df_e)
+
+    # Réparations Internes
+    st.subheader("🔧 Réparations Internes")
+    df_ri = vehicle_frames.get("Réparations Internes", pd.DataFrame())
+    if df_ri.empty:
+        st.info("Aucune réparation interne enregistrée.")
+    else:
+        df_ri_formatted = pre_format_columns(df_ri, ["Coût_Total"], [])
+        st.dataframe(df_ri_formatted, use_container_width=True)
+        if 'Date d_entrée à Andraharo' in df_ri.columns and 'Coût_Total' in df_ri.columns:
+            show_figure(file_hash, vehicle, "reparations", None, df_ri)
+
+    # Prestations Externes
+    st.subheader("🌐 Prestations Externes")
+    df_pe = vehicle_frames.get("Prestation externe", pd.DataFrame())
+    if df_pe.empty:
+        st.info("Aucune prestation externe enregistrée.")
+    else:
+        df_pe_formatted = pre_format_columns(df_pe, ["Coût_Total"], [])
+        st.dataframe(df_pe_formatted, use_container_width=True)
+        if 'Type de Prestation' in df_pe.columns and 'Coût_Total' in df_pe.columns:
+            show_figure(file_hash, vehicle, "prestations", None, df_pe)
+
+@st.fragment
+def render_kilometrage(file_hash, vehicle, vehicle_frames):
+    st.subheader("📈 Suivi du kilométrage")  # CHANGÉ EN BAR CHART
+    df_km = vehicle_frames.get("Suivi_Kilométrage", pd.DataFrame())
+    if df_km.empty:
         st.info("Aucune donnée de kilométrage disponible.")
-     else:
+    else:
         # TRI ET CALCUL KM PARCOCUS (nouveau)
         df_km = df_km.sort_values("Date").reset_index(drop=True)  # Trier par date pour diff correcte
         df_km['Km_Parcourus'] = df_km['Kilométrage'].diff().fillna(0)  # Diff km + 0 pour 1ère ligne
@@ -285,196 +324,451 @@ if uploaded_file:
         st.dataframe(df_km_formatted, use_container_width=True)
         
         if 'Date' in df_km.columns and 'Km_Parcourus' in df_km.columns:
-            # Bar chart avec km parcourus
-            fig_km = px.bar(df_km, x='Date', y='Km_Parcourus', title='Évolution des kilomètres parcourus')
-            fig_km.update_yaxes(title_text="Km Parcourus entre Dates")
-            st.plotly_chart(fig_km, use_container_width=True)
-
-    with tab4:  # SÉQUENTIEL (Haut/Bas) au lieu de côte à côte
-        st.subheader("📋 Assurances")
-        df_ass_display = df_vehicle_specific.get("Assurance", pd.DataFrame())
-        if not df_ass_display.empty:
-            df_ass_formatted = pre_format_columns(df_ass_display, ["Montant"], [])
-            st.dataframe(df_ass_formatted, use_container_width=True)
-        else:
-            st.dataframe(df_ass_display, use_container_width=True)
-        
-        st.subheader("🔍 Visites Techniques")
-        df_vt_display = df_vehicle_specific.get("Visite_Technique", pd.DataFrame())
-        df_vt_display_formatted = pre_format_columns(df_vt_display, [], [])
-        st.dataframe(df_vt_display_formatted, use_container_width=True)  # Pas de monétaire ici
-
-    with tab5:  # SÉQUENTIEL (Haut/Bas) au lieu de côte à côte
-        st.subheader("🛒 Achats réalisés")
-        df_ach = df_vehicle_specific.get("Achats", pd.DataFrame())
-        if df_ach.empty:
-            st.info("Aucun Achats réalisés.")
-        else:
-            df_ach_formatted = pre_format_columns(df_ach, ["Prix_Unitaire", "Prix_Total"], ["Quantité"])
-            st.dataframe(df_ach_formatted, use_container_width=True)
-            if 'Nom_du_fournisseur' in df_ach.columns and 'Prix_Total' in df_ach.columns:
-                fig_ach = px.pie(df_ach, names='Nom_du_fournisseur', values='Prix_Total', title='Achats par Fournisseur (Ar)')
-                fig_ach.update_traces(textinfo='label+percent+value', texttemplate='%{label}<br>%{percent}<br>%{value} Ar')
-                st.plotly_chart(fig_ach, use_container_width=True)
-        
-        st.subheader("📇 Liste des fournisseurs")
-        st.dataframe(dfs["Fournisseurs"], use_container_width=True)
-
-    with tab6:  # ONGLET CARBURANT (SUPPRIMÉ PIE)
-        st.subheader("⛽ Consommation de carburant")
-        df_carbu = df_vehicle_specific.get("Carburant", pd.DataFrame())
-        if df_carbu.empty:
-            st.info("Aucune donnée de carburant disponible.")
-        else:
-            # Tableau avec formats
-            df_carbu_formatted = pre_format_columns(df_carbu, ["Prix_Litre", "Total_Ar"], ["Litres"])
-            st.dataframe(df_carbu_formatted, use_container_width=True)
-            
-            # Graphique Litres par date (bar) - UNIQUEMENT
-            if 'Date' in df_carbu.columns and 'Litres' in df_carbu.columns:
-                fig_litres = px.bar(df_carbu, x='Date', y='Litres', color='Type_Carburant', title='Évolution de la consommation de carburant (L)')
-                fig_litres.update_yaxes(title_text="Litres (L)")
-                st.plotly_chart(fig_litres, use_container_width=True)
-
-    with tab7:
-        st.subheader("📊Tableau de bord global")
-        # KPIs globaux
-        total_veh = len(df_vehicules_filtered)
-        total_coût = (dfs.get("Entretien", pd.DataFrame())["Coût_Total"].sum() + 
-                      dfs.get("Réparations Internes", pd.DataFrame())["Coût_Total"].sum() + 
-                      dfs.get("Prestation externe", pd.DataFrame())["Coût_Total"].sum() + 
-                      dfs.get("Achats", pd.DataFrame())["Prix_Total"].sum() + 
-                      dfs.get("Carburant", pd.DataFrame())["Total_Ar"].sum())  # AJOUT Carburant
-        col_g1, col_g2, col_g3 = st.columns(3)
-        col_g1.metric("🚗 Nombre de véhicules", total_veh)
-        col_g2.metric("💰 Coût total global", f"{total_coût:,.0f}".replace(",", " ") + " Ar")
-        col_g3.metric("⏱ date de dernière mise à jour", format_date_fr(today))
-
-        # Graphique global : Coûts par direction
-        df_coûts_dir = df_vehicules.merge(dfs.get("Entretien", pd.DataFrame()), on="Immatriculation", how="left")
-        df_coûts_dir["Coût_Total"] = df_coûts_dir["Coût_Total"].fillna(0)
-        money_cols_global = ["Coût_Total"]
-        config_global = format_money_columns(df_coûts_dir, money_cols_global)
-        fig_global = px.bar(df_coûts_dir.groupby("Direction")["Coût_Total"].sum().reset_index(), 
-                            x="Direction", y="Coût_Total", title="Coûts totaux d’entretien et de réparation par Direction (Ar)")
-        fig_global.update_yaxes(title_text="Coût (Ar)")
-        st.plotly_chart(fig_global, use_container_width=True)
+            show_series_figure(file_hash, vehicle, "kilometrage", df_km, "Km_Parcourus")
+
+@st.fragment
+def render_assurances(vehicle_frames, compliance_index, fleet_vehicles, today):  # SÉQUENTIEL (Haut/Bas) au lieu de côte à côte
+    st.subheader("📋 Assurances")
+    df_ass_display = vehicle_frames.get("Assurance", pd.DataFrame())
+    if not df_ass_display.empty:
+        df_ass_formatted = pre_format_columns(df_ass_display, ["Montant"], [])
+        st.dataframe(df_ass_formatted, use_container_width=True)
+    else:
+        st.dataframe(df_ass_display, use_container_width=True)
+    
+    st.subheader("🔍 Visites Techniques")
+    df_vt_display = vehicle_frames.get("Visite_Technique", pd.DataFrame())
+    df_vt_display_formatted = pre_format_columns(df_vt_display, [], [])
+    st.dataframe(df_vt_display_formatted, use_container_width=True)  # Pas de monétaire ici
+
+    # Conformité de toute la flotte (Directions sélectionnées), lue dans l'index des échéances
+    st.subheader("🚨 Conformité de la flotte")
+    jours = st.number_input("Échéance d'assurance dans les N jours", min_value=0, max_value=365, value=30, step=5)
+    alerts = compliance_alerts(compliance_index, today, jours, fleet_vehicles)
+    col_a1, col_a2, col_a3 = st.columns(3)
+    col_a1.metric("⚠️ Assurances expirées", len(alerts["expirees"]))
+    col_a2.metric(f"⏳ Assurances à renouveler sous {jours} jours", len(alerts["a_renouveler"]))
+    col_a3.metric("🔍 Véhicules avec visite technique expirée", len(alerts["visites_expirees"]))
+    for titre, key in [("Assurances expirées", "expirees"), (f"Assurances expirant sous {jours} jours", "a_renouveler")]:
+        if not alerts[key].empty:
+            st.markdown(f"**{titre}**")
+            st.dataframe(pre_format_columns(alerts[key], [], []), hide_index=True, use_container_width=True)
+    if not alerts["visites_expirees"].empty:
+        st.markdown("**Visites techniques expirées**")
+        st.dataframe(alerts["visites_expirees"], hide_index=True, use_container_width=True)
+
+@st.fragment
+def render_achats(file_hash, vehicle, vehicle_frames, df_fournisseurs):  # SÉQUENTIEL (Haut/Bas) au lieu de côte à côte
+    st.subheader("🛒 Achats réalisés")
+    df_ach = vehicle_frames.get("Achats", pd.DataFrame())
+    if df_ach.empty:
+        st.info("Aucun Achats réalisés.")
+    else:
+        df_ach_formatted = pre_format_columns(df_ach, ["Prix_Unitaire", "Prix_Total"], ["Quantité"])
+        st.dataframe(df_ach_formatted, use_container_width=True)
+        if 'Nom_du_fournisseur' in df_ach.columns and 'Prix_Total' in df_ach.columns:
+            show_figure(file_hash, vehicle, "achats", None, df_ach)
+    
+    st.subheader("📇 Liste des fournisseurs")
+    st.dataframe(df_fournisseurs, use_container_width=True)
+
+@st.fragment
+def render_carburant(file_hash, vehicle, vehicle_frames, ranking):  # ONGLET CARBURANT (SUPPRIMÉ PIE)
+    st.subheader("⛽ Consommation de carburant")
+    df_carbu = vehicle_frames.get("Carburant", pd.DataFrame())
+    if df_carbu.empty:
+        st.info("Aucune donnée de carburant disponible.")
+    else:
+        # Tableau avec formats
+        df_carbu_formatted, config_carbu = display_table(df_carbu, ["Prix_Litre", "Total_Ar"], ["Litres"])
+        st.dataframe(df_carbu_formatted, column_config=config_carbu, use_container_width=True)
         
-        # AJOUT : Répartition Carburant par Type (pie globale)
-        df_carbu_global = dfs.get("Carburant", pd.DataFrame())
-        if not df_carbu_global.empty and 'Type_Carburant' in df_carbu_global.columns and 'Total_Ar' in df_carbu_global.columns:
-            fig_carbu_type = px.pie(df_carbu_global, names='Type_Carburant', values='Total_Ar', title='Répartition Coûts Carburant par Type (Ar)')
-            fig_carbu_type.update_traces(textinfo='label+percent+value', texttemplate='%{label}<br>%{percent}<br>%{value} Ar')
-            st.plotly_chart(fig_carbu_type, use_container_width=True)
-
-        # Export Rapport
-        st.subheader("📥Génération du rapport")
-        resume_data = {
-            "Immatriculation": selected_vehicle,
-            "Direction": vehicule_info["Direction"],
-            "Kilométrage Actuel": f"{int(dernier_km):,}".replace(",", " ") + " km",
-            "Coût Entretien": f"{total_entretien:,.0f}".replace(",", " ") + " Ar",
-            "Coût Réparations": f"{total_reparations:,.0f}".replace(",", " ") + " Ar",
-            "Coût Achats": f"{total_achats:,.0f}".replace(",", " ") + " Ar",
-            "Coût Total Mécanique": f"{cout_total_veh:,.0f}".replace(",", " ") + " Ar",
-            "Total Litres Carburant": f"{total_litres:,.1f}".replace(",", " ") + " L",
-            "Coût Carburant": f"{total_carbu_ar:,.0f}".replace(",", " ") + " Ar",
-            "Coût Total Global": f"{cout_total_veh + total_carbu_ar:,.0f}".replace(",", " ") + " Ar",
-            "Date Rapport": format_date_fr(today.date())
-        }
-        df_resume = pd.DataFrame([resume_data])
-        st.dataframe(df_resume, use_container_width=True)
-
-        # Export Excel amélioré (avec format Ar et L, espaces pour milliers)
-        buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-            workbook = writer.book
-            header_format = workbook.add_format({'bold': True, 'text_wrap': True, 'valign': 'top', 'fg_color': '#D7E4BC'})
-            money_format = workbook.add_format({'num_format': '# ##0 "Ar"'})  # Espaces au lieu de virgules
-            liter_format = workbook.add_format({'num_format': '#,##0.0 "L"'})  # Format avec "L"
-            
-            df_resume.to_excel(writer, sheet_name="Résumé", index=False)
-            worksheet = writer.sheets["Résumé"]
-            for col_num, value in enumerate(df_resume.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-            # Appliquer formats aux colonnes
-            for col in ["Coût Entretien", "Coût Réparations", "Coût Achats", "Coût Total Mécanique", "Coût Carburant", "Coût Total Global"]:
-                col_idx = list(df_resume.columns).index(col) + 1
-                worksheet.set_column(col_idx, col_idx, None, money_format)
-            for col in ["Total Litres Carburant"]:
-                col_idx = list(df_resume.columns).index(col) + 1
-                worksheet.set_column(col_idx, col_idx, None, liter_format)
-
-            # Pour les autres feuilles
-            sheets_money = {
-                "Entretien": ["Coût_Total"],
-                "Réparations Internes": ["Coût_Total"],
-                "Prestation externe": ["Coût_Total"],  # Corrigé "Prestations Externes"
-                "Assurance": ["Montant"],
-                "Achats": ["Prix_Unitaire", "Prix_Total"],
-                "Carburant": ["Prix_Litre", "Total_Ar"],
-                "Suivi_Kilométrage": []  # Renommé pour cohérence
-            }
-            sheets_liter = {
-                "Carburant": ["Litres"]
-            }
-            for sheet_name, df_sheet_orig in [("Entretien", df_vehicle_specific.get("Entretien", pd.DataFrame())),
-                                         ("Réparations Internes", df_vehicle_specific.get("Réparations Internes", pd.DataFrame())),
-                                         ("Prestation externe", df_vehicle_specific.get("Prestation externe", pd.DataFrame())),
-                                         ("Assurance", df_vehicle_specific.get("Assurance", pd.DataFrame())),
-                                         ("Visite_Technique", df_vehicle_specific.get("Visite_Technique", pd.DataFrame())),
-                                         ("Achats", df_vehicle_specific.get("Achats", pd.DataFrame())),
-                                         ("Carburant", df_vehicle_specific.get("Carburant", pd.DataFrame())),
-                                         ("Suivi_Kilométrage", df_vehicle_specific.get("Suivi_Kilométrage", pd.DataFrame())),
-                                         ("Parc_Véhicules", df_vehicules)]:
-                df_sheet = df_sheet_orig.copy()
-                # Formater les dates en texte français pour l'export
-                date_cols = df_sheet.select_dtypes(include=['datetime64[ns]']).columns
-                for col in date_cols:
-                    df_sheet[col] = df_sheet[col].apply(format_date_fr)
-                df_sheet.to_excel(writer, sheet_name=sheet_name, index=False)
-                ws = writer.sheets[sheet_name]
-                if sheet_name in sheets_money:
-                    for col in sheets_money[sheet_name]:
-                        if col in df_sheet.columns:
-                            col_idx = list(df_sheet.columns).index(col) + 1
-                            ws.set_column(col_idx, col_idx, None, money_format)
-                if sheet_name in sheets_liter:
-                    for col in sheets_liter[sheet_name]:
-                        if col in df_sheet.columns:
-                            col_idx = list(df_sheet.columns).index(col) + 1
-                            ws.set_column(col_idx, col_idx, None, liter_format)
-
-        buffer.seek(0)
+        # Graphique Litres par date (bar) - UNIQUEMENT
+        if 'Date' in df_carbu.columns and 'Litres' in df_carbu.columns and 'Type_Carburant' in df_carbu.columns:
+            show_series_figure(file_hash, vehicle, "litres", df_carbu, "Litres", "Type_Carburant")
+
+    # Classement de la flotte par consommation (pleins rapprochés des relevés kilométriques)
+    st.subheader("🏁 Classement consommation de la flotte")
+    if ranking.empty:
+        st.info("Aucun plein rapprochable d'un relevé kilométrique sur la période.")
+        return
+    rang_vehicule = ranking.loc[ranking["Immatriculation"] == str(vehicle)]
+    if not rang_vehicule.empty:
+        ligne = rang_vehicule.iloc[0]
+        ar_km = f"{ligne['Ar_km']:,.0f}".replace(",", " ")
+        st.caption(f"{vehicle} : {ligne['L_100km']:.1f} L/100 km, {ar_km} Ar/km — rang {ligne['Rang']} / {len(ranking)}, "
+                   f"{ligne['Anomalies']} plein(s) anormal(aux)")
+    ranking_formatted, config_ranking = display_table(ranking, ["Total_Ar"], ["Litres", "Km_Parcourus"])
+    config_ranking["L_100km"] = st.column_config.NumberColumn(label="L/100 km", format="%.1f")
+    config_ranking["Ar_km"] = st.column_config.NumberColumn(label="Ar/km", format="%.0f Ar")
+    st.dataframe(ranking_formatted, column_config=config_ranking, hide_index=True, use_container_width=True)
+
+# Colonnes du comparatif de la flotte (KPIs de compute_fleet_kpis) -> libellés affichés
+COMPARATIF_COLONNES = {
+    "Immatriculation": "Immatriculation", "Direction": "Direction", "dernier_km": "Kilométrage",
+    "total_entretien": "Entretien", "total_reparations": "Réparations", "total_achats": "Achats de pièces",
+    "cout_total_veh": "Entretien et réparation", "total_litres": "Litres", "total_carbu_ar": "Carburant",
+    "cout_total_global": "Coût total", "fin_assurance": "Fin d'assurance", "visites_expirees": "Visites expirées",
+}
+COMPARATIF_MONTANTS = ["Entretien", "Réparations", "Achats de pièces", "Entretien et réparation", "Carburant", "Coût total"]
+
+# Comparatif de tous les véhicules : tri sur le tableau numérique complet, puis seule la page affichée est
+# formatée et envoyée au navigateur
+@st.fragment
+def render_comparatif(fleet_kpis, vehicle):
+    st.subheader("🏆 Comparatif de la flotte")
+    if fleet_kpis.empty:
+        st.info("Aucun véhicule dans les Directions sélectionnées.")
+        return
+    col_tri, col_ordre, col_taille, col_page = st.columns([2, 1, 1, 1])
+    colonnes = list(COMPARATIF_COLONNES)
+    tri = col_tri.selectbox("Trier par", colonnes, index=colonnes.index("cout_total_global"),
+                            format_func=COMPARATIF_COLONNES.get, key="comparatif_tri")
+    decroissant = col_ordre.toggle("Décroissant", value=True, key="comparatif_ordre")
+    taille = col_taille.selectbox("Lignes par page", [25, 50, 100], key="comparatif_taille")
+    pages = -(-len(fleet_kpis) // taille)
+    page = col_page.number_input(f"Page (sur {pages})", min_value=1, max_value=pages, value=1,
+                                 key=f"comparatif_page_{pages}")
+
+    ordered = fleet_kpis.sort_values(tri, ascending=not decroissant, kind="stable", na_position="last",
+                                     ignore_index=True)
+    rang = np.flatnonzero(ordered["Immatriculation"].to_numpy() == str(vehicle))
+    if len(rang):
+        st.caption(f"{vehicle} : rang {rang[0] + 1} / {len(ordered)} ({COMPARATIF_COLONNES[tri]})")
+    page_df = ordered.iloc[(page - 1) * taille:page * taille].rename(columns=COMPARATIF_COLONNES)
+    page_df.insert(0, "Rang", np.arange((page - 1) * taille + 1, (page - 1) * taille + len(page_df) + 1))
+    page_formatted, config_page = display_table(page_df, COMPARATIF_MONTANTS, ["Kilométrage", "Litres"])
+    st.dataframe(page_formatted, column_config=config_page, hide_index=True, use_container_width=True)
+
+@st.fragment
+def render_tableau_global(file_hash, df_vehicules_filtered, selected_directions, cube_periode, today, period):
+    st.subheader("📊Tableau de bord global")
+    # KPIs globaux (cube restreint à la période et aux Directions sélectionnées)
+    cube_global = slice_cube(cube_periode, directions=selected_directions)
+    totaux_globaux = cube_totals(cube_global)
+    total_veh = len(df_vehicules_filtered)
+    total_coût = (totaux_globaux["total_entretien"] + totaux_globaux["total_reparations"] +
+                  totaux_globaux["total_achats"] + totaux_globaux["total_carbu_ar"])  # AJOUT Carburant
+    col_g1, col_g2, col_g3 = st.columns(3)
+    col_g1.metric("🚗 Nombre de véhicules", total_veh)
+    col_g2.metric("💰 Coût total global", f"{total_coût:,.0f}".replace(",", " ") + " Ar")
+    col_g3.metric("⏱ date de dernière mise à jour", format_date_fr(today))
+
+    # Graphique global : Coûts par direction (toutes les catégories de coûts)
+    params = (period, tuple(selected_directions))
+    df_coûts_dir = cube_global.groupby(["Direction", "Catégorie"], as_index=False)["Montant"].sum()
+    show_figure(file_hash, None, "directions", params, df_coûts_dir)
+    
+    # AJOUT : Répartition Carburant par Type (pie globale)
+    df_carbu_global = (cube_global[cube_global["Catégorie"] == "Carburant"]
+                       .groupby("Type_Carburant", as_index=False)["Montant"].sum())
+    if not df_carbu_global.empty:
+        show_figure(file_hash, None, "carbu_type", params, df_carbu_global)
+
+@st.fragment
+def render_export(file_hash, vehicle, vehicule_info, kpis, today, period, vehicle_frames, vehicle_cube,
+                  df_vehicules, load_batch, directions, selected_directions, dataset_chunks):
+    # Export Rapport
+    st.subheader("📥Génération du rapport")
+    df_resume = build_resume(vehicle, vehicule_info["Direction"], kpis, today, period)
+    st.dataframe(df_resume, use_container_width=True)
+
+    # Rapport généré uniquement à la demande (puis conservé par classeur / véhicule / date)
+    report_key = (file_hash, vehicle, today, period)
+    if st.button("⚙️ Préparer le rapport Excel"):
+        st.session_state["rapports_demandes"] = st.session_state.get("rapports_demandes", set()) | {report_key}
+    if report_key in st.session_state.get("rapports_demandes", set()):
         st.download_button(
             label="📥 Télécharger Rapport Excel",
-            data=buffer,
-            file_name=f"Rapport_{selected_vehicle}_{today.date().strftime('%Y%m%d')}.xlsx",
+            data=get_vehicle_report(file_hash, vehicle, today, period, vehicle_frames, vehicle_cube, df_vehicules),
+            file_name=report_file_name(vehicle, today),
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
-else:
-    st.info("👆 Veuillez charger un fichier Excel pour commencer.")
-# Footer fixe avec nom du créateur
-st.markdown(
-    """
-    <style>
-    .footer {
-        position: fixed;
-        bottom: 0;
-        left: 0;
-        width: 100%;
-        background-color: #f0f2f6;
-        border-top: 1px solid #d6d9dc;
-        text-align: center;
-        padding: 10px;
-        font-size: 16px;
-        z-index: 1000;
-        color: #666;
-    }
-    </style>
-    <div class="footer">
-       <i style='color:red; font-weight:bold;'>Créé par RANAIVOSOA Tojoarimanana Hiratriniala / Tél : +261 33 51 880 19</i>
-    </div>
-    """,
-    unsafe_allow_html=True
-)
+
+    # Mode lot : un rapport par véhicule d'une Direction (ou de toute la flotte) dans une archive zip
+    with st.expander("📦 Rapports par lot"):
+        scope = st.selectbox("Périmètre", options=["Toute la flotte"] + directions)
+        if st.button("⚙️ Générer les rapports (zip)"):
+            with st.spinner("Génération des rapports..."):
+                st.session_state["rapport_lot"] = (
+                    scope, get_reports_zip(file_hash, scope, today, period, load_batch, df_vehicules))
+        lot = st.session_state.get("rapport_lot")
+        if lot and lot[0] == scope:
+            st.download_button(
+                label="📥 Télécharger les rapports (zip)",
+                data=lot[1],
+                file_name=f"Rapports_{scope.replace(' ', '_')}_{today.date().strftime('%Y%m%d')}.zip",
+                mime="application/zip"
+            )
+
+    # Export complet des Directions sélectionnées sur la période : écrit par morceaux dans un fichier temporaire
+    # (remplacé à chaque nouvel export) plutôt qu'en mémoire
+    with st.expander("🗄 Export complet des données filtrées"):
+        fmt = st.radio("Format", list(EXPORT_FORMATS), format_func=EXPORT_FORMATS.get, horizontal=True)
+        export_key = (file_hash, tuple(selected_directions), period, fmt)
+        if st.button("⚙️ Préparer l'export complet"):
+            with st.spinner("Export en cours..."):
+                previous = st.session_state.pop("export_complet", None)
+                if previous and os.path.exists(previous[1]):
+                    os.unlink(previous[1])
+                with stage("export complet"):
+                    st.session_state["export_complet"] = (export_key, export_dataset(dataset_chunks(), fmt))
+        export = st.session_state.get("export_complet")
+        if export and export[0] == export_key and os.path.exists(export[1]):
+            scope = "Toute la flotte" if len(selected_directions) == len(directions) else "_".join(selected_directions)
+            # Téléchargement différé : le fichier n'est lu qu'au clic (pas à chaque exécution du fragment). Limite :
+            # Streamlit le sert ensuite depuis la mémoire, le temps du téléchargement.
+            st.caption(f"Fichier prêt : {os.path.getsize(export[1]) / 1e6:.1f} Mo")
+            st.download_button(
+                label="📥 Télécharger l'export complet",
+                data=partial(Path(export[1]).read_bytes),
+                file_name=export_file_name(fmt, scope, today),
+                mime=EXPORT_MIME[fmt]
+            )
+
+# Panneau de performance : durée / mémoire par étape de l'exécution, hits et recalculs des caches
+# (exécution et cumul de la session), export optionnel des traces
+def render_perf_panel(record):
+    st.markdown(f"**⏱ Exécution : {record['duree_totale_s'] * 1000:.0f} ms** "
+                f"(mémoire du processus {record['rss_octets'] / 1e6:.0f} Mo)")
+    st.dataframe(pd.DataFrame([
+        {"Étape": name, "Durée (ms)": round(entry["secondes"] * 1000, 1), "Appels": entry["appels"],
+         "Mémoire (Mo)": round(entry["memoire_octets"] / 1e6, 2)}
+        for name, entry in record["etapes"].items()
+    ]), hide_index=True, use_container_width=True)
+    session_caches = st.session_state.setdefault("caches_perf", {})
+    rows = []
+    for name, entry in record["caches"].items():
+        total = session_caches.setdefault(name, {"hits": 0, "recalculs": 0})
+        total["hits"] += entry["hits"]
+        total["recalculs"] += entry["recalculs"]
+        rows.append({"Cache": name, "Hits": entry["hits"], "Recalculs": entry["recalculs"],
+                     "Hits (session)": total["hits"], "Recalculs (session)": total["recalculs"]})
+    st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+    if st.checkbox(f"Enregistrer les traces dans {TRACE_FILE}", key="traces_perf"):
+        append_trace(record)
+
+# Page du tableau de bord (exécutée à chaque rerun de Streamlit)
+def main():
+    # Configuration de la page
+    st.set_page_config(page_title="Suivi des Véhicules OMNIS ", layout="wide", initial_sidebar_state="expanded")
+    st.title("🚗📊 Suivi des Véhicules OMNIS ")
+
+    # Sidebar pour filtres globaux
+    st.sidebar.header("🔧 Filtres Globaux")
+    uploaded_files = st.sidebar.file_uploader("📁 Charger un ou plusieurs fichiers Excel (un par période)", type=["xlsx"],
+                                              accept_multiple_files=True,
+                                              help="Les lignes présentes dans plusieurs fichiers sont reprises du fichier "
+                                                   "dont la dernière opération est la plus récente, quel que soit "
+                                                   "l'ordre de chargement.")
+
+    if uploaded_files:
+        session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex[:8])
+        start_trace(session=session_id)
+        with st.spinner("Chargement des données..."):
+            with stage("hachage"):
+                # Un hash par classeur, puis un hash du jeu (l'ordre de chargement départage les classeurs de même date)
+                file_hashes = [get_file_hash(uploaded_file) for uploaded_file in uploaded_files]
+                file_hash = combine_hashes(file_hashes)
+            with stage("chargement"):
+                if STOCKAGE_SQLITE:
+                    db = get_sqlite_store(file_hash, file_hashes, uploaded_files)
+                    row_counts, load_stats = (sheet_row_counts(db), {}) if db else ({}, {})
+                else:
+                    data, load_stats = load_and_clean_data(file_hash, file_hashes, uploaded_files, session_id)
+                    row_counts = {sheet: len(df) for sheet, df in data.items()}
+
+        if not row_counts:
+            st.error("Impossible de charger les données. Veuillez vérifier le fichier.")
+            st.stop()
+
+        st.sidebar.success("✅ Données chargées" + (f" ({len(uploaded_files)} classeurs consolidés)" if len(uploaded_files) > 1 else ""))
+
+        # Stats de chargement (bonus) ; les mesures de l'exécution sont ajoutées en fin de script
+        perf_panel = st.sidebar.expander("📈 Statistiques Chargement")
+        with perf_panel:
+            for sheet, n_rows in row_counts.items():
+                sheet_stats = load_stats.get(sheet, {})
+                timing = ", ".join(f"{stage} {seconds:.2f} s" for stage, seconds in sheet_stats.items() if stage != "mémoire")
+                st.write(f"{sheet}: {n_rows} lignes ({timing})")
+                if "mémoire" in sheet_stats:
+                    avant, apres = sheet_stats["mémoire"]
+                    st.caption(f"Mémoire : {avant / 1e6:.2f} Mo → {apres / 1e6:.2f} Mo "
+                               f"({avant - apres:,} octets économisés)".replace(",", " "))
+
+        # Récupérer les DataFrames avec gestion d'erreurs (AJOUT "Carburant")
+        dfs = {}
+        for sheet in REQUIRED_SHEETS:
+            if sheet not in row_counts:
+                st.error(f"Feuille '{sheet}' manquante. est manquante. Veuillez utiliser le fichier Excel .")
+                st.stop()
+            if not STOCKAGE_SQLITE:
+                dfs[sheet] = data[sheet]
+
+        df_vehicules = get_sqlite_sheet(file_hash, "Parc_Véhicules", db) if STOCKAGE_SQLITE else dfs["Parc_Véhicules"]
+        directions = sorted(df_vehicules["Direction"].dropna().unique())
+        selected_directions = st.sidebar.multiselect("🏢 Directions", options=directions, default=directions)
+        # Période par défaut : toutes les opérations du jeu de données (l'année écoulée s'il n'a aucune date)
+        first_date, last_date = get_date_range(file_hash, partial(query_date_range, db) if STOCKAGE_SQLITE
+                                               else partial(data_date_range, dfs))
+        if first_date is None:
+            last_date = pd.Timestamp(dt.date.today())
+            first_date = last_date - relativedelta(years=1)
+        periode = st.sidebar.date_input("📅 Période", value=(first_date.date(), last_date.date()))
+        if len(periode) != 2:
+            st.info("Sélectionnez la date de fin de la période.")
+            st.stop()
+        date_start, date_end = periode
+        period = (pd.Timestamp(date_start), pd.Timestamp(date_end))
+
+        df_vehicules_filtered = df_vehicules[df_vehicules["Direction"].isin(selected_directions)]
+        if df_vehicules_filtered.empty:
+            st.warning("Aucune direction valide sélectionnée.")
+            st.stop()
+
+        # Sélection véhicule
+        selected_vehicle = st.selectbox("🚗 Sélection du véhicule", options=df_vehicules_filtered["Immatriculation"].unique())
+
+        with stage("filtrage"):
+            if STOCKAGE_SQLITE:
+                # Lignes du véhicule et part du cube lues par les index SQLite ; cube de la flotte déjà agrégé par
+                # Direction pour le tableau global
+                df_vehicle_specific = query_vehicle_frames(db, selected_vehicle)
+                cube_periode = query_cube_summary(db, date_start, date_end)
+                vehicle_cube = query_cube(db, date_start, date_end, vehicle=selected_vehicle)
+                load_batch = partial(query_batch, db, start=date_start, end=date_end)
+                dataset_chunks = partial(sqlite_chunks, db, selected_directions, date_start, date_end)
+            else:
+                # Infos véhicule filtrées (via l'index par véhicule, sans rescanner les feuilles)
+                vehicle_index = get_vehicle_index(file_hash, dfs)
+                df_vehicle_specific = select_vehicle_rows(dfs, vehicle_index, selected_vehicle)
+
+                # Coûts lus dans le cube agrégé, restreint à la période sélectionnée
+                cube_periode = slice_cube(get_cost_cube(file_hash, dfs), date_start, date_end)
+                vehicle_cube = cube_for_vehicle(cube_periode, selected_vehicle)
+                load_batch = partial(batch_from_memory, dfs, vehicle_index, cube_periode)
+                dataset_chunks = partial(memory_chunks, dfs, selected_directions, date_start, date_end)
+            vehicule_info = df_vehicle_specific["Parc_Véhicules"].iloc[0]
+
+        # Dashboard Global en haut (KPIs en 2 lignes, unité Km ajoutée, format espace, SUPPRIMÉ deltas)
+        # Ligne 1 : 4 KPIs
+        with stage("kpis"):
+            kpis = compute_vehicle_kpis(df_vehicle_specific, vehicle_cube)
+        dernier_km = kpis["dernier_km"]
+        total_entretien = kpis["total_entretien"]
+        total_reparations = kpis["total_reparations"]
+        total_achats = kpis["total_achats"]
+        cout_total_veh = kpis["cout_total_veh"]
+        total_litres = kpis["total_litres"]
+        total_carbu_ar = kpis["total_carbu_ar"]
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("📏 Kilométrage", f"{int(dernier_km):,}".replace(",", " ") + " km")
+        with col2:
+            st.metric("🛠 Coût d’entretien", f"{total_entretien:,.0f}".replace(",", " ") + " Ar")
+        with col3:
+            st.metric("🔧 Coût des réparations", f"{total_reparations:,.0f}".replace(",", " ") + " Ar")
+        with col4:
+            st.metric("🛒 Coûts totaux des achats de pièces", f"{total_achats:,.0f}".replace(",", " ") + " Ar")
+
+        # Ligne 2 : 3 KPIs
+        col5, col6, col7 = st.columns(3)
+        with col5:
+            st.metric("💰 Coûts totaux d’entretien et de réparation", f"{cout_total_veh:,.0f}".replace(",", " ") + " Ar")
+        with col6:
+            st.metric("⛽ Consommation totale de carburant (L)", f"{total_litres:,.1f}".replace(",", " ") + " L")
+        with col7:
+            st.metric("⛽ Coûts de consommation de carburant", f"{total_carbu_ar:,.0f}".replace(",", " ") + " Ar")
+
+        # Alertes (ex. : assurances expirées)
+        today = pd.to_datetime(dt.date.today())  # Convertir en datetime64[ns] pour compatibilité pandas
+        df_ass = df_vehicle_specific.get("Assurance", pd.DataFrame())
+        if not df_ass.empty and "Date_Fin" in df_ass.columns:
+            # Normaliser les dates pour ignorer l'heure (sur une copie : les données en cache ne sont pas modifiées)
+            nb_ass_exp = int((pd.to_datetime(df_ass["Date_Fin"]).dt.normalize() < today).sum())
+            if nb_ass_exp:
+                st.error(f"⚠️ {nb_ass_exp} assurance(s) expirée(s) pour {selected_vehicle} !")
+
+        df_vt = df_vehicle_specific.get("Visite_Technique", pd.DataFrame())
+        if not df_vt.empty and "Etat" in df_vt.columns:
+            vt_exp = df_vt[df_vt["Etat"] == "Expiré"]
+            if not vt_exp.empty:
+                st.warning(f"🔍 {len(vt_exp)} visite(s) technique(s) à renouveler.")
+
+        # Onglets améliorés (AJOUT onglet "⛽ Carburant") : seul l'onglet affiché est calculé
+        onglet = st.radio("Onglet", ONGLETS, horizontal=True, label_visibility="collapsed", key="onglet")
+
+        with stage("rendu onglet"):
+            if onglet == ONGLETS[0]:
+                render_fiche_vehicule(selected_vehicle, vehicule_info)
+            elif onglet == ONGLETS[1]:
+                render_entretien(file_hash, selected_vehicle, df_vehicle_specific)
+            elif onglet == ONGLETS[2]:
+                render_kilometrage(file_hash, selected_vehicle, df_vehicle_specific)
+            elif onglet == ONGLETS[3]:
+                compliance_index = query_compliance_index(db) if STOCKAGE_SQLITE else get_compliance_index(file_hash, dfs)
+                render_assurances(df_vehicle_specific, compliance_index,
+                                  df_vehicules_filtered["Immatriculation"].dropna().unique().tolist(), today)
+            elif onglet == ONGLETS[4]:
+                df_fournisseurs = get_sqlite_sheet(file_hash, "Fournisseurs", db) if STOCKAGE_SQLITE else dfs["Fournisseurs"]
+                render_achats(file_hash, selected_vehicle, df_vehicle_specific, df_fournisseurs)
+            elif onglet == ONGLETS[5]:
+                # Classement de la flotte (Directions sélectionnées) sur la période
+                if STOCKAGE_SQLITE:
+                    ranking = query_efficiency_ranking(db, selected_directions, *period)
+                else:
+                    ranking = fleet_efficiency_ranking(get_fuel_efficiency(file_hash, dfs),
+                                                       df_vehicules_filtered["Immatriculation"].dropna().unique().tolist(),
+                                                       *period)
+                render_carburant(file_hash, selected_vehicle, df_vehicle_specific, ranking)
+            elif onglet == ONGLETS[6]:
+                # KPIs de la flotte (Directions sélectionnées) sur la période
+                if STOCKAGE_SQLITE:
+                    load_kpis = partial(query_fleet_kpis, db, date_start, date_end, selected_directions)
+                else:
+                    load_kpis = partial(compute_fleet_kpis, dfs, get_cost_cube(file_hash, dfs), date_start, date_end,
+                                        selected_directions, get_compliance_index(file_hash, dfs))
+                render_comparatif(get_fleet_kpis(file_hash, period, tuple(selected_directions), load_kpis), selected_vehicle)
+            else:
+                render_tableau_global(file_hash, df_vehicules_filtered, selected_directions, cube_periode, today, period)
+                render_export(file_hash, selected_vehicle, vehicule_info, kpis, today, period, df_vehicle_specific,
+                              vehicle_cube, df_vehicules, load_batch, directions, selected_directions, dataset_chunks)
+
+        # Mesures de l'exécution dans le panneau de statistiques (et trace JSON lines si activée)
+        perf_record = finish_trace(fichier=file_hash, vehicule=selected_vehicle, onglet=onglet)
+        with perf_panel:
+            render_perf_panel(perf_record)
+    else:
+        # Classeur retiré : le jeu de données partagé est libéré s'il n'est plus utilisé par aucune session
+        if "session_id" in st.session_state:
+            release_dataset(st.session_state["session_id"])
+        st.info("👆 Veuillez charger un fichier Excel pour commencer.")
+    # Footer fixe avec nom du créateur
+    st.markdown(
+        """
+        <style>
+        .footer {
+            position: fixed;
+            bottom: 0;
+            left: 0;
+            width: 100%;
+            background-color: #f0f2f6;
+            border-top: 1px solid #d6d9dc;
+            text-align: center;
+            padding: 10px;
+            font-size: 16px;
+            z-index: 1000;
+            color: #666;
+        }
+        </style>
+        <div class="footer">
+           <i style='color:red; font-weight:bold;'>Créé par RANAIVOSOA Tojoarimanana Hiratriniala / Tél : +261 33 51 880 19</i>
+        </div>
+        """,
+        unsafe_allow_html=True
+    )
+
+# Streamlit exécute ce script sous le nom "__main__" ; les processus "spawn" des pools de fleet_core le
+# réimportent sous "__mp_main__" et ne relancent donc pas la page
+if __name__ == "__main__":
+    main()
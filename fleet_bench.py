@@ -0,0 +1,171 @@
+# Banc de mesure reproductible du suivi de parc : chaque étape (chargement, filtrage véhicule, pré-formatage,
+# agrégation du tableau global, export Excel) est chronométrée séparément avec son pic mémoire, et les résultats
+# sont écrits en JSON pour comparer les versions entre elles.
+# Exemple : python fleet_bench.py --vehicules 10000 --carburant 2000000 --kilometrage 2000000 -o bench.json
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import fleet_core
+from fleet_core import (hash_bytes, read_workbook, load_workbook_data, build_vehicle_index, select_vehicle_rows,
+                        pre_format_columns, build_cost_cube, cube_for_vehicle, slice_cube, cube_totals,
+                        compute_vehicle_kpis, compute_fleet_kpis, build_vehicle_report, build_reports_zip)
+from fleet_synth import DEFAULT_SCALE, generate_workbook
+
+BENCH_FORMAT_VERSION = 1
+
+# Chronométrage d'une étape : `repeat` exécutions, pic mémoire Python (tracemalloc, allocations numpy comprises)
+# mesuré sur une exécution séparée pour ne pas fausser les temps
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {
+        "secondes": [round(t, 6) for t in timings],
+        "mediane_s": round(statistics.median(timings), 6),
+        "min_s": round(min(timings), 6),
+        "pic_memoire_mo": round(peak / 1024 ** 2, 2),
+    }
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(path, repeat=3, sample_vehicles=20, batch_vehicles=10, seed=0):
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    file_hash = hash_bytes(file_bytes)
+    stages = {}
+
+    # Chargement : lecture + nettoyage complets, puis relecture depuis le cache disque (dossier temporaire)
+    dfs, stages["chargement"] = measure(lambda: read_workbook(file_bytes)[0], repeat)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        previous_dir = fleet_core.CACHE_DIR
+        fleet_core.CACHE_DIR = Path(cache_dir)
+        try:
+            load_workbook_data(file_hash, file_bytes)
+            _, stages["chargement_cache_disque"] = measure(lambda: load_workbook_data(file_hash, file_bytes), repeat)
+        finally:
+            fleet_core.CACHE_DIR = previous_dir
+
+    # Filtrage véhicule : index construit une fois, puis lignes d'un échantillon de véhicules
+    rng = np.random.default_rng(seed)
+    plates = dfs["Parc_Véhicules"]["Immatriculation"].dropna().astype(str).unique()
+    sample = rng.choice(plates, min(sample_vehicles, len(plates)), replace=False)
+    vehicle_index, stages["index_vehicules"] = measure(lambda: build_vehicle_index(dfs), repeat)
+    _, stages["filtrage_vehicule"] = measure(
+        lambda: [select_vehicle_rows(dfs, vehicle_index, v) for v in sample], repeat)
+    stages["filtrage_vehicule"]["vehicules"] = len(sample)
+
+    # Pré-formatage des tableaux : feuille Carburant complète (plus gros tableau affiché)
+    _, stages["pre_format_columns"] = measure(
+        lambda: pre_format_columns(dfs["Carburant"], ["Prix_Litre", "Total_Ar"], ["Litres"]), repeat)
+    stages["pre_format_columns"]["lignes"] = len(dfs["Carburant"])
+
+    # Tableau global : cube de coûts, restriction à la période et agrégations du tableau de bord
+    cube, stages["cube_couts"] = measure(lambda: build_cost_cube(dfs), repeat)
+    dates = dfs["Carburant"]["Date"].dropna()
+    start, end = dates.min(), dates.max()
+
+    def global_dashboard():
+        cube_global = slice_cube(cube, start, end)
+        totals = cube_totals(cube_global)
+        by_direction = cube_global.groupby(["Direction", "Catégorie"], as_index=False, observed=True)["Montant"].sum()
+        fuel = (cube_global[cube_global["Catégorie"] == "Carburant"]
+                .groupby("Type_Carburant", as_index=False, observed=True)["Montant"].sum())
+        return totals, by_direction, fuel
+
+    _, stages["agregation_globale"] = measure(global_dashboard, repeat)
+    _, stages["kpis_flotte"] = measure(lambda: compute_fleet_kpis(dfs, cube, start, end), repeat)
+
+    # Export Excel : rapport d'un véhicule, puis archive d'un lot de véhicules
+    today = pd.Timestamp(dt.date.today())
+    period = (start, end)
+    vehicle = sample[0]
+    frames = select_vehicle_rows(dfs, vehicle_index, vehicle)
+    vehicle_cube = cube_for_vehicle(slice_cube(cube, start, end), vehicle)
+    compute_vehicle_kpis(frames, vehicle_cube)
+    _, stages["export_excel_vehicule"] = measure(
+        lambda: build_vehicle_report(vehicle, frames, vehicle_cube, dfs["Parc_Véhicules"], today, period), repeat)
+    batch = {v: select_vehicle_rows(dfs, vehicle_index, v) for v in sample[:batch_vehicles]}
+    _, stages["export_excel_lot"] = measure(
+        lambda: build_reports_zip(batch, cube, dfs["Parc_Véhicules"], today, period), 1)
+    stages["export_excel_lot"]["vehicules"] = len(batch)
+
+    return {
+        "format": BENCH_FORMAT_VERSION,
+        "date": dt.datetime.now().isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "environnement": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processeurs": os.cpu_count(),
+        },
+        "classeur": {
+            "fichier": os.path.basename(path),
+            "taille_mo": round(len(file_bytes) / 1024 ** 2, 2),
+            "lignes": {sheet: len(df) for sheet, df in dfs.items()},
+        },
+        "repetitions": repeat,
+        "etapes": stages,
+        # Pic de mémoire résidente du processus (ko sous Linux), y compris les allocations hors Python
+        "pic_rss_mo": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mesure les performances du suivi de parc sur un classeur")
+    parser.add_argument("--classeur", help="Classeur existant à mesurer (sinon un classeur synthétique est généré)")
+    for key, value in DEFAULT_SCALE.items():
+        parser.add_argument(f"--{key}", type=int, default=value, help=f"Volume synthétique (défaut {value})")
+    parser.add_argument("--graine", type=int, default=0, help="Graine du classeur synthétique et de l'échantillon")
+    parser.add_argument("-n", "--repetitions", type=int, default=3, help="Exécutions par étape")
+    parser.add_argument("--echantillon", type=int, default=20, help="Véhicules filtrés par mesure")
+    parser.add_argument("--lot", type=int, default=10, help="Véhicules de l'export par lot")
+    parser.add_argument("-o", "--output", help="Fichier JSON de résultats (sortie standard par défaut)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = args.classeur
+        scale = None
+        if path is None:
+            scale = {key: getattr(args, key) for key in DEFAULT_SCALE}
+            path = os.path.join(work_dir, "parc_synthetique.xlsx")
+            t0 = time.perf_counter()
+            generate_workbook(path, scale, args.graine)
+            print(f"Classeur synthétique généré en {time.perf_counter() - t0:.1f} s", file=sys.stderr)
+        results = run_benchmarks(path, args.repetitions, args.echantillon, args.lot, args.graine)
+    results["echelle_synthetique"] = scale
+    payload = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
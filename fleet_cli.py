@@ -0,0 +1,52 @@
+# Traitement par lot du suivi de parc sans navigateur : KPIs de tous les véhicules d'un classeur (ou de plusieurs
+# classeurs consolidés, le plus récent d'après les dates des feuilles l'emportant) en CSV ou JSON
+# Exemple : python fleet_cli.py parc_2024.xlsx parc_2025.xlsx --debut 2025-01-01 --fin 2025-12-31 -f json -o kpis.json
+import argparse
+import sys
+import pandas as pd
+from functools import partial
+from pathlib import Path
+from fleet_core import (hash_bytes, load_workbook_data, load_workbooks, consolidate_workbooks, missing_sheets,
+                        compute_fleet_kpis)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="KPIs de tous les véhicules d'un classeur de suivi de parc")
+    parser.add_argument("classeurs", nargs="+", help="Fichier(s) Excel (.xlsx) du suivi de parc, dans n'importe quel ordre")
+    parser.add_argument("-f", "--format", choices=["csv", "json"], default="csv", help="Format de sortie (csv par défaut)")
+    parser.add_argument("-o", "--output", help="Fichier de sortie (sortie standard par défaut)")
+    parser.add_argument("--debut", help="Début de la période (AAAA-MM-JJ)")
+    parser.add_argument("--fin", help="Fin de la période (AAAA-MM-JJ)")
+    parser.add_argument("--directions", nargs="+", help="Limiter aux Directions indiquées")
+    parser.add_argument("--sans-cache", action="store_true", help="Ne pas lire ni écrire le cache disque")
+    return parser.parse_args(argv)
+
+def write_kpis(kpis, fmt, output):
+    target = output or sys.stdout
+    if fmt == "json":
+        kpis.to_json(target, orient="records", date_format="iso", force_ascii=False, indent=2)
+        if output is None:
+            sys.stdout.write("\n")
+    else:
+        kpis.to_csv(target, index=False)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Chaque classeur est lu une seule fois : les mêmes octets servent au hash et, hors cache, à l'analyse
+    contents = [Path(path).read_bytes() for path in args.classeurs]
+    if args.sans_cache:
+        datasets = [load_workbook_data(hash_bytes(file_bytes), file_bytes, use_cache=False) for file_bytes in contents]
+    else:
+        datasets = load_workbooks([(hash_bytes(file_bytes), partial(bytes, file_bytes)) for file_bytes in contents])
+    dfs, _ = consolidate_workbooks(datasets)
+    missing = missing_sheets(dfs)
+    if missing:
+        print(f"Feuilles manquantes : {', '.join(missing)}", file=sys.stderr)
+        return 1
+    start = pd.Timestamp(args.debut) if args.debut else None
+    end = pd.Timestamp(args.fin) if args.fin else None
+    kpis = compute_fleet_kpis(dfs, start=start, end=end, directions=args.directions)
+    write_kpis(kpis, args.format, args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,952 @@
+# Noyau de calcul du suivi de parc, indépendant de Streamlit : chargement, index, KPIs, alertes et rapports
+# (importable par les workers de process pool, la CLI fleet_cli.py et les scripts de mesure)
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from types import MappingProxyType
+import pandas as pd
+import numpy as np
+
+# Fonction pour formater les dates en français
+def format_date_fr(date):
+    if pd.isna(date) or date is None:
+        return ""
+    if isinstance(date, str):
+        date = pd.to_datetime(date)
+    months = {
+        1: 'janvier', 2: 'février', 3: 'mars', 4: 'avril',
+        5: 'mai', 6: 'juin', 7: 'juillet', 8: 'août',
+        9: 'septembre', 10: 'octobre', 11: 'novembre', 12: 'décembre'
+    }
+    return f"{date.day} {months[date.month]} {date.year}"
+
+# Noms de mois pour le formatage vectorisé des dates (index = mois - 1)
+MOIS_FR = np.array(['janvier', 'février', 'mars', 'avril', 'mai', 'juin', 'juillet',
+                    'août', 'septembre', 'octobre', 'novembre', 'décembre'], dtype=object)
+
+# Version vectorisée de format_date_fr pour une colonne entière (même rendu, "" pour les dates manquantes) :
+# chaque jour distinct n'est formaté qu'une fois, puis le libellé est redistribué par ses codes
+def format_dates_fr(series):
+    if series.empty:
+        return series
+    codes, days = pd.factorize(pd.to_datetime(series).dt.normalize())
+    labels = (days.day.astype(str).to_numpy(dtype=object) + " " + MOIS_FR[days.month.to_numpy() - 1]
+              + " " + days.year.astype(str).to_numpy(dtype=object))
+    # Code -1 (date manquante) -> dernier élément, la chaîne vide
+    out = np.append(labels, "")[codes]
+    return pd.Series(out, index=series.index, name=series.name)
+
+# Équivalent vectorisé de f"{x:,.0f}".replace(",", " ") : arrondi numpy puis regroupement des chiffres
+# par 3 sur une matrice de caractères (chaque groupe est précédé d'une espace, les espaces de tête sont retirées)
+def _format_thousands(values):
+    rounded = np.rint(values)
+    finite = np.isfinite(rounded)
+    digits = np.abs(np.where(finite, rounded, 0)).astype(np.int64).astype(str)
+    width = -(-max(digits.dtype.itemsize // 4, 1) // 3) * 3
+    chars = np.char.rjust(digits, width).astype(f"U{width}").view("U1").reshape(-1, width // 3, 3)
+    spaced = np.concatenate([np.full(chars.shape[:2] + (1,), " "), chars], axis=2)
+    grouped = np.char.lstrip(np.ascontiguousarray(spaced).reshape(len(values), -1).view(f"U{width + width // 3}").ravel())
+    out = np.char.add(np.where(np.signbit(rounded), "-", ""), grouped).astype(object)
+    out[~finite] = [f"{x:,.0f}" for x in values[~finite]]
+    return out
+
+# Formate une colonne numérique en bloc ; repli cellule par cellule pour les colonnes non numériques
+# (ex. fiche véhicule transposée) ou les montants hors de la plage exacte des flottants
+def _format_number_column(series, kind, suffix=""):
+    if series.empty:
+        return series
+    values = series.to_numpy()
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        values = values.astype(np.float64)
+        if kind == "thousands" and np.nanmax(np.abs(np.where(np.isinf(values), 0, values)), initial=0) < 2 ** 53:
+            out = _format_thousands(values)
+        elif kind != "thousands":
+            out = np.char.mod(kind, values).astype(object)
+        else:
+            out = np.array([f"{x:,.0f}".replace(",", " ") for x in values], dtype=object)
+    elif kind == "thousands":
+        out = np.array([f"{x:,.0f}".replace(",", " ") for x in values], dtype=object)
+    else:
+        out = np.array([kind % x for x in values], dtype=object)
+    if suffix:
+        out = out + suffix
+    return pd.Series(out, index=series.index, name=series.name)
+
+# Fonction utilitaire pour pré-formater colonnes avec espaces (pour tableaux)
+def pre_format_columns(df, money_cols, quantity_cols):
+    df_formatted = df.copy()
+    for col in money_cols:
+        if col in df.columns:
+            df_formatted[col] = _format_number_column(df_formatted[col], "thousands", " Ar")
+    for col in quantity_cols:
+        if col in df.columns:
+            if col == "Litres":
+                df_formatted[col] = _format_number_column(df_formatted[col], "%.1f", " L")
+            elif col in ("Kilométrage", "Km_Parcourus"):
+                df_formatted[col] = _format_number_column(df_formatted[col], "thousands", " km")
+            elif col == "Quantité":
+                df_formatted[col] = _format_number_column(df_formatted[col], "%.1f")
+            else:
+                df_formatted[col] = _format_number_column(df_formatted[col], "%.0f")
+    
+    # Formatage des colonnes dates
+    date_cols = df_formatted.select_dtypes(include=['datetime64[ns]']).columns
+    for col in date_cols:
+        df_formatted[col] = format_dates_fr(df_formatted[col])
+    
+    return df_formatted
+
+# Feuilles attendues dans le classeur
+REQUIRED_SHEETS = ["Parc_Véhicules", "Entretien", "Réparations Internes", "Prestation externe",
+                   "Suivi_Kilométrage", "Garage", "Fournisseurs", "Achats", "Assurance", "Visite_Technique", "Carburant"]
+
+def hash_bytes(file_bytes):
+    return hashlib.md5(file_bytes).hexdigest()
+
+# Schéma déclaré des feuilles : colonnes dates, montants (Ar), quantités et catégories.
+# Les colonnes dont le nom commence par "Date" sont aussi des dates ; hors schéma, les colonnes texte peu variées
+# passent aussi en catégories. Les colonnes numériques sont réduites en int32 / float32 quand c'est sans perte.
+SHEET_SCHEMA = {
+    "Parc_Véhicules": {"money": ["Prix_Achat"], "category": ["Direction"]},
+    "Entretien": {"money": ["Coût_Total"], "category": ["Immatriculation", "Type_Entretien"]},
+    "Réparations Internes": {"dates": ["Date d_entrée à Andraharo"], "money": ["Coût_Total"],
+                             "category": ["Immatriculation", "Panne"]},
+    "Prestation externe": {"money": ["Coût_Total"], "category": ["Immatriculation", "Type de Prestation"]},
+    "Suivi_Kilométrage": {"quantity": ["Kilométrage"], "category": ["Immatriculation"]},
+    "Garage": {},
+    "Fournisseurs": {},
+    "Achats": {"money": ["Prix_Unitaire", "Prix_Total"], "quantity": ["Quantité"],
+               "category": ["Immatriculation", "Nom_du_fournisseur"]},
+    "Assurance": {"dates": ["Date_Fin"], "money": ["Montant"], "category": ["Immatriculation"]},
+    "Visite_Technique": {"category": ["Immatriculation", "Etat"]},
+    "Carburant": {"money": ["Prix_Litre", "Total_Ar"], "quantity": ["Litres"],
+                  "category": ["Immatriculation", "Type_Carburant"]},
+}
+# Au-delà de cette proportion de valeurs distinctes, une colonne texte reste en texte
+CATEGORY_MAX_RATIO = 0.5
+
+# Conversion explicite d'une colonne date (numéros de série Excel ou texte jj/mm/aaaa)
+def _to_datetime_col(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        dates = series
+    elif pd.api.types.is_numeric_dtype(series):
+        dates = pd.to_datetime(series, unit='D', origin='1899-12-30', errors='coerce')
+    else:
+        dates = pd.to_datetime(series, errors='coerce', dayfirst=True)
+    return dates.astype("datetime64[ns]")
+
+# Type numérique le plus compact sans perte : int32 pour les entiers dans la plage, float32 si l'aller-retour est exact
+def _compact_numeric(series):
+    if pd.api.types.is_bool_dtype(series) or series.empty:
+        return series
+    values = series.to_numpy(dtype=np.float64)
+    if np.all(np.isfinite(values)) and np.all(values == np.round(values)):
+        int32 = np.iinfo(np.int32)
+        if values.min() >= int32.min and values.max() <= int32.max:
+            return series.astype(np.int32)
+        return series
+    if series.dtype == np.float64 and np.array_equal(values.astype(np.float32).astype(np.float64), values, equal_nan=True):
+        return series.astype(np.float32)
+    return series
+
+# Nettoyage d'une feuille (indépendant des autres feuilles, donc exécutable en parallèle)
+def clean_sheet(sheet, df):
+    schema = SHEET_SCHEMA.get(sheet, {})
+    # Nettoyage : Supprimer lignes vides
+    df = df.dropna(how='all')  # Supprimer lignes entièrement vides
+    
+    # Dates déclarées par le schéma (plus de détection des int64 par nunique)
+    for col in df.columns:
+        if col in schema.get("dates", []) or str(col).startswith("Date"):
+            df[col] = _to_datetime_col(df[col])
+    
+    # Montants et quantités déclarés : forcés en numérique
+    for col in schema.get("money", []) + schema.get("quantity", []):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    
+    # Nettoyage supplémentaire : Remplacer NaN par 0 dans colonnes numériques
+    numeric_cols = df.select_dtypes(include=[np.number]).columns
+    df[numeric_cols] = df[numeric_cols].fillna(0)
+    
+    # FIX SPÉCIFIQUE : "Quantité" dans Achats, valeurs négatives ou absurdes -> valeur absolue
+    if sheet == "Achats" and "Quantité" in df.columns:
+        df["Quantité"] = df["Quantité"].abs()
+    
+    # Types compacts : numériques réduits, textes peu variés en catégories
+    for col in df.select_dtypes(include=[np.number]).columns:
+        df[col] = _compact_numeric(df[col])
+    for col in df.columns:
+        if pd.api.types.infer_dtype(df[col], skipna=True) != "string":
+            continue
+        if col in schema.get("category", []) or df[col].nunique() <= CATEGORY_MAX_RATIO * len(df):
+            df[col] = df[col].astype("category")
+    
+    return df
+
+def _timed_clean(sheet, df):
+    start = time.perf_counter()
+    memory_before = df.memory_usage(deep=True).sum()
+    df = clean_sheet(sheet, df)
+    return df, time.perf_counter() - start, (int(memory_before), int(df.memory_usage(deep=True).sum()))
+
+# Moteur d'ingestion : le classeur est ouvert UNE seule fois (openpyxl en lecture seule / streaming
+# via pd.ExcelFile) et toutes les feuilles sont lues dans cette même passe. L'archive openpyxl n'étant
+# pas thread-safe, la lecture XML reste séquentielle, mais le décodage/nettoyage de chaque feuille est
+# confié à un pool de workers et se fait pendant la lecture des feuilles suivantes.
+def read_workbook(file_bytes, max_workers=None):
+    data = {}
+    stats = {}
+    pending = {}
+    with pd.ExcelFile(BytesIO(file_bytes), engine="openpyxl") as xls:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for sheet in xls.sheet_names:
+                start = time.perf_counter()
+                raw = xls.parse(sheet)
+                pending[sheet] = (time.perf_counter() - start, pool.submit(_timed_clean, sheet, raw))
+            # Conserver l'ordre des feuilles du classeur
+            for sheet, (parse_time, future) in pending.items():
+                df, clean_time, memory = future.result()
+                data[sheet] = df
+                stats[sheet] = {"lecture": parse_time, "nettoyage": clean_time, "mémoire": memory}
+    return data, stats
+
+# Cache disque colonnaire (Arrow IPC / Feather) des feuilles nettoyées, indexé par le hash du classeur.
+# Survit aux redémarrages du serveur ; à incrémenter dès que le nettoyage change le contenu des feuilles.
+CACHE_SCHEMA_VERSION = 2
+CACHE_DIR = Path(os.environ.get("SUIVI_CACHE_DIR", ".cache_donnees"))
+CACHE_MAX_BYTES = int(os.environ.get("SUIVI_CACHE_MAX_MB", "512")) * 1024 * 1024
+CACHE_MANIFEST = "manifest.json"
+# Sous-dossier des bases SQLite (fleet_sqlite), comptées dans la même taille maximale
+CACHE_SQLITE_DIR = "sqlite"
+
+def _cache_root():
+    return CACHE_DIR / f"v{CACHE_SCHEMA_VERSION}"
+
+def _dir_size(path):
+    return sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+
+# Supprimer les entrées écrites par une ancienne version du schéma de nettoyage ; seuls les dossiers "v<n>"
+# sont concernés (SUIVI_CACHE_DIR peut désigner un dossier qui contient d'autres données)
+def purge_stale_cache():
+    if not CACHE_DIR.is_dir():
+        return
+    for entry in CACHE_DIR.iterdir():
+        if entry.is_dir() and re.fullmatch(r"v\d+", entry.name) and entry.name != _cache_root().name:
+            shutil.rmtree(entry, ignore_errors=True)
+
+# Éviction LRU jusqu'à repasser sous la taille maximale : entrées Feather (date de dernier accès = mtime du
+# manifeste) et bases SQLite (mtime du fichier, mis à jour à chaque utilisation)
+def evict_cache(keep=None):
+    root = _cache_root()
+    if not root.is_dir():
+        return
+    entries = []
+    for entry in root.iterdir():
+        manifest = entry / CACHE_MANIFEST
+        if entry.is_dir() and manifest.is_file():
+            entries.append((manifest.stat().st_mtime, entry, _dir_size(entry)))
+    sqlite_dir = root / CACHE_SQLITE_DIR
+    if sqlite_dir.is_dir():
+        for entry in sqlite_dir.glob("[!.]*.sqlite"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, entry, stat.st_size))
+    total = sum(size for _, _, size in entries)
+    for _, entry, size in sorted(entries, key=lambda e: e[0]):
+        if total <= CACHE_MAX_BYTES:
+            break
+        if entry.name == keep or entry.stem == keep:
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            entry.unlink(missing_ok=True)
+        total -= size
+
+# Relire les feuilles nettoyées d'un classeur déjà vu (lecture memory-mapped, sans recompression)
+def load_cached_sheets(file_hash):
+    from pyarrow import feather  # import paresseux : le noyau reste rapide à importer
+    entry = _cache_root() / file_hash
+    manifest_path = entry / CACHE_MANIFEST
+    if not manifest_path.is_file():
+        return None
+    try:
+        start = time.perf_counter()
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        data = {}
+        stats = {}
+        for sheet, filename in manifest["sheets"]:
+            sheet_start = time.perf_counter()
+            data[sheet] = feather.read_table(entry / filename, memory_map=True).to_pandas()
+            stats[sheet] = {"cache disque": time.perf_counter() - sheet_start}
+            if sheet in manifest.get("memory", {}):
+                stats[sheet]["mémoire"] = tuple(manifest["memory"][sheet])
+        os.utime(manifest_path)  # Marquer l'entrée comme récemment utilisée
+        return data, stats
+    except Exception:
+        # Entrée corrompue ou illisible : on l'écarte et on repasse par le classeur
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+
+# Écrire les feuilles nettoyées (écriture dans un dossier temporaire puis renommage atomique)
+def store_cached_sheets(file_hash, data, stats=None):
+    from pyarrow import feather
+    root = _cache_root()
+    try:
+        root.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=root, prefix=".tmp-"))
+    except OSError:
+        return
+    try:
+        sheets = []
+        for i, (sheet, df) in enumerate(data.items()):
+            filename = f"{i:02d}.feather"
+            feather.write_feather(df, tmp_dir / filename, compression="uncompressed")
+            sheets.append((sheet, filename))
+        (tmp_dir / CACHE_MANIFEST).write_text(
+            json.dumps({"schema": CACHE_SCHEMA_VERSION, "sheets": sheets,
+                        "memory": {sheet: sheet_stats["mémoire"] for sheet, sheet_stats in (stats or {}).items()
+                                   if "mémoire" in sheet_stats}},
+                       ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_dir, root / file_hash)
+    except Exception:
+        # Types non sérialisables en Arrow (colonnes mixtes...) ou entrée déjà écrite par un autre worker
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+    evict_cache(keep=file_hash)
+
+# Chargement complet d'un classeur : cache disque si le contenu est connu, sinon lecture + nettoyage
+def load_workbook_data(file_hash, file_bytes, use_cache=True):
+    if use_cache:
+        purge_stale_cache()
+        cached = load_cached_sheets(file_hash)
+        if cached is not None:
+            return cached
+    data, stats = read_workbook(file_bytes)
+    if use_cache:
+        store_cached_sheets(file_hash, data, stats)
+    return data, stats
+
+# Plusieurs classeurs (un export par période) : chaque fichier est relu depuis le cache disque par son hash ;
+# seuls les fichiers jamais vus sont analysés, en parallèle dans un process pool (openpyxl est en pur Python,
+# donc limité par le GIL en threads). `files` : liste de (hash, fonction renvoyant le contenu du fichier).
+def load_workbooks(files, max_workers=None):
+    purge_stale_cache()
+    results = {}
+    missing = {}
+    for file_hash, read_bytes in files:
+        if file_hash in results or file_hash in missing:
+            continue
+        cached = load_cached_sheets(file_hash)
+        if cached is not None:
+            results[file_hash] = cached
+        else:
+            missing[file_hash] = read_bytes
+    if len(missing) <= 1 or max_workers == 1:
+        for file_hash, read_bytes in missing.items():
+            results[file_hash] = load_workbook_data(file_hash, read_bytes())
+    else:
+        # "spawn" : pas de fork d'un serveur multi-thread (Streamlit)
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers or min(len(missing), os.cpu_count() or 1),
+                                 mp_context=context) as pool:
+            futures = {file_hash: pool.submit(load_workbook_data, file_hash, read_bytes())
+                       for file_hash, read_bytes in missing.items()}
+            for file_hash, future in futures.items():
+                results[file_hash] = future.result()
+    return [results[file_hash] for file_hash, _ in files]
+
+# Clés naturelles de dédoublonnage entre classeurs (colonnes absentes ignorées ; à défaut, toutes les colonnes)
+NATURAL_KEYS = {
+    "Parc_Véhicules": ["Immatriculation"],
+    "Entretien": ["Immatriculation", "Date", "Type_Entretien", "Coût_Total"],
+    "Réparations Internes": ["Immatriculation", "Date d_entrée à Andraharo", "Panne", "Coût_Total"],
+    "Prestation externe": ["Immatriculation", "Date", "Type de Prestation", "Coût_Total"],
+    "Suivi_Kilométrage": ["Immatriculation", "Date"],
+    "Garage": ["Nom_Garage"],
+    "Fournisseurs": ["Nom_du_fournisseur"],
+    "Achats": ["Immatriculation", "Date", "Nom_du_fournisseur", "Prix_Total"],
+    "Assurance": ["Immatriculation", "Date_Debut"],
+    "Visite_Technique": ["Immatriculation", "Date"],
+    "Carburant": ["Immatriculation", "Date", "Litres"],
+}
+
+def combine_hashes(file_hashes):
+    if len(file_hashes) == 1:
+        return file_hashes[0]
+    return hash_bytes("+".join(file_hashes).encode())
+
+# Fusion d'une feuille : pour chaque clé naturelle, seules les lignes du classeur le plus récent (dernier de la
+# liste) qui la contient sont gardées — les exports qui se chevauchent ne sont pas comptés deux fois, les
+# lignes répétées à l'intérieur d'un même classeur sont conservées
+def _merge_sheet(sheet, parts):
+    if len(parts) == 1:
+        return parts[0]
+    categories = [col for col in parts[0].columns
+                  if any(isinstance(part[col].dtype, pd.CategoricalDtype) for part in parts if col in part.columns)]
+    merged = pd.concat([part.assign(_fichier=i) for i, part in enumerate(parts)], ignore_index=True)
+    for col in categories:
+        merged[col] = merged[col].astype("category")
+    keys = [col for col in NATURAL_KEYS.get(sheet, []) if col in merged.columns]
+    keys = keys or [col for col in merged.columns if col != "_fichier"]
+    latest = merged.groupby(keys, dropna=False, observed=True, sort=False)["_fichier"].transform("max")
+    return merged[merged["_fichier"] == latest].drop(columns="_fichier").reset_index(drop=True)
+
+# Première et dernière opération d'un jeu de données (colonne date de chaque feuille, cf. COST_DATE_COLS ; les
+# échéances comme Date_Fin d'assurance ne comptent pas) ; (None, None) sans aucune date
+def data_date_range(sheets):
+    first = last = None
+    for sheet, df in sheets.items():
+        date_col = COST_DATE_COLS.get(sheet, "Date")
+        if date_col in df.columns and pd.api.types.is_datetime64_any_dtype(df[date_col]):
+            sheet_first, sheet_last = df[date_col].min(), df[date_col].max()
+            if pd.notna(sheet_first):
+                first = sheet_first if first is None else min(first, sheet_first)
+                last = sheet_last if last is None else max(last, sheet_last)
+    return first, last
+
+# Date de la dernière opération d'un classeur : sert à ordonner les classeurs du plus ancien au plus récent,
+# indépendamment de l'ordre de chargement (pd.Timestamp.min pour un classeur sans aucune date)
+def workbook_last_date(sheets):
+    last = data_date_range(sheets)[1]
+    return pd.Timestamp.min if last is None else last
+
+# Jeu de données consolidé de plusieurs classeurs, avec les temps cumulés. Les classeurs sont ordonnés par
+# date de dernière opération (à égalité ou sans date, ordre de chargement) : le plus récent l'emporte à la fusion
+def consolidate_workbooks(datasets):
+    if len(datasets) == 1:
+        return datasets[0]
+    last_dates = [workbook_last_date(sheets) for sheets, _ in datasets]
+    order = sorted(range(len(datasets)), key=lambda i: (last_dates[i], i))
+    datasets = [datasets[i] for i in order]
+    data = {}
+    stats = {}
+    for sheet in dict.fromkeys(sheet for sheets, _ in datasets for sheet in sheets):
+        start = time.perf_counter()
+        data[sheet] = _merge_sheet(sheet, [sheets[sheet] for sheets, _ in datasets if sheet in sheets])
+        sheet_stats = {}
+        for _, file_stats in datasets:
+            for stage, value in file_stats.get(sheet, {}).items():
+                if stage != "mémoire":
+                    sheet_stats[stage] = sheet_stats.get(stage, 0.0) + value
+        sheet_stats["fusion"] = time.perf_counter() - start
+        stats[sheet] = sheet_stats
+    return data, stats
+
+def missing_sheets(data):
+    return [sheet for sheet in REQUIRED_SHEETS if sheet not in data]
+
+# Jeux de données partagés entre sessions : un seul exemplaire en lecture seule par classeur (hash), jamais copié
+# par session. Chaque appelant reçoit des copies superficielles (copy-on-write : une modification locale copie
+# les colonnes touchées sans altérer l'exemplaire partagé). Un jeu est retiré dès que plus aucune session ne
+# l'utilise (nouveau classeur chargé, classeur retiré) ou, au-delà de DATASET_MAX_ENTRIES, le moins récent.
+DATASET_MAX_ENTRIES = int(os.environ.get("SUIVI_DATASETS_MAX", "4"))
+_datasets = OrderedDict()
+_dataset_owners = {}
+_datasets_lock = threading.Lock()
+# Verrou de chargement par classeur et nombre de sessions qui l'utilisent : retiré quand plus personne
+# ne l'attend et que le jeu n'est plus en mémoire
+_loading_locks = {}
+
+# Vues superficielles des feuilles partagées : isolées grâce au copy-on-write de pandas 3 (requirements.txt)
+def dataset_view(sheets):
+    return {sheet: df.copy(deep=False) for sheet, df in sheets.items()}
+
+def _forget_dataset(file_hash):
+    _datasets.pop(file_hash, None)
+    slot = _loading_locks.get(file_hash)
+    if slot is not None and slot[1] == 0:
+        del _loading_locks[file_hash]
+
+def _drop_unused(file_hash):
+    if file_hash is not None and file_hash not in _dataset_owners.values():
+        _forget_dataset(file_hash)
+
+# Jeu de données du classeur `file_hash` pour la session `owner` ; `load()` -> (feuilles, stats) n'est appelé
+# qu'une fois par classeur, même si plusieurs sessions le demandent en même temps
+def acquire_dataset(file_hash, load, owner=None):
+    with _datasets_lock:
+        slot = _loading_locks.setdefault(file_hash, [threading.Lock(), 0])
+        slot[1] += 1
+    try:
+        with slot[0]:
+            with _datasets_lock:
+                entry = _datasets.get(file_hash)
+            if entry is None:
+                data, stats = load()
+                entry = (MappingProxyType(dict(data)), MappingProxyType(dict(stats)))
+            # Publié avant de rendre le verrou de chargement : une session en attente trouve l'entrée sans recharger
+            with _datasets_lock:
+                _datasets[file_hash] = entry
+                _datasets.move_to_end(file_hash)
+                if owner is not None:
+                    previous = _dataset_owners.get(owner)
+                    _dataset_owners[owner] = file_hash
+                    if previous != file_hash:
+                        _drop_unused(previous)
+                while len(_datasets) > DATASET_MAX_ENTRIES:
+                    oldest = next(iter(_datasets))
+                    if oldest == file_hash:
+                        break
+                    _forget_dataset(oldest)
+    finally:
+        with _datasets_lock:
+            slot[1] -= 1
+            if slot[1] == 0 and file_hash not in _datasets:
+                del _loading_locks[file_hash]
+    return dataset_view(entry[0]), entry[1]
+
+# La session n'utilise plus de classeur : son jeu est retiré s'il n'est partagé avec aucune autre
+def release_dataset(owner):
+    with _datasets_lock:
+        _drop_unused(_dataset_owners.pop(owner, None))
+
+# Index par véhicule : positions des lignes de chaque Immatriculation dans chaque feuille,
+# calculé une seule fois par jeu de données (une passe groupby par feuille)
+def build_vehicle_index(dfs):
+    index = {}
+    for sheet, df in dfs.items():
+        if "Immatriculation" in df.columns:
+            index[sheet] = df.groupby("Immatriculation", sort=False, observed=True).indices
+    return index
+
+# Lignes d'un véhicule dans chaque feuille : coût proportionnel aux lignes du véhicule, pas à la flotte
+def select_vehicle_rows(dfs, vehicle_index, vehicle):
+    no_rows = np.array([], dtype=np.intp)
+    return {sheet: dfs[sheet].iloc[positions.get(vehicle, no_rows)] for sheet, positions in vehicle_index.items()}
+
+# Sources du cube de coûts : feuille -> (catégorie de coût, colonne montant)
+COST_SOURCES = {
+    "Entretien": ("Entretien", "Coût_Total"),
+    "Réparations Internes": ("Réparations internes", "Coût_Total"),
+    "Prestation externe": ("Prestations externes", "Coût_Total"),
+    "Achats": ("Achats", "Prix_Total"),
+    "Carburant": ("Carburant", "Total_Ar"),
+}
+# Colonne date de chaque feuille de coûts ("Date" par défaut, sinon première colonne datetime)
+COST_DATE_COLS = {"Réparations Internes": "Date d_entrée à Andraharo"}
+CUBE_DIMS = ["Immatriculation", "Direction", "Mois", "Catégorie", "Type_Carburant"]
+
+def _cost_date_col(sheet, df):
+    date_cols = df.select_dtypes(include=["datetime64"]).columns
+    col = COST_DATE_COLS.get(sheet, "Date")
+    if col in date_cols:
+        return col
+    return date_cols[0] if len(date_cols) else None
+
+# Cube agrégé véhicule × Direction × mois × catégorie de coût (montants en Ar, litres pour le carburant),
+# construit une fois par jeu de données. Trié par véhicule pour les recherches par dichotomie.
+def build_cost_cube(dfs):
+    parts = []
+    for sheet, (category, value_col) in COST_SOURCES.items():
+        df = dfs.get(sheet)
+        if df is None or value_col not in df.columns or "Immatriculation" not in df.columns:
+            continue
+        df = df[df["Immatriculation"].notna()]
+        date_col = _cost_date_col(sheet, df)
+        months = (pd.to_datetime(df[date_col]).dt.to_period("M").dt.to_timestamp() if date_col
+                  else pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]"))
+        is_fuel = sheet == "Carburant"
+        parts.append(pd.DataFrame({
+            "Immatriculation": df["Immatriculation"].astype(str).to_numpy(),
+            "Mois": months.to_numpy(),
+            "Catégorie": category,
+            "Type_Carburant": (df["Type_Carburant"].astype(object).to_numpy() if is_fuel and "Type_Carburant" in df.columns
+                               else None),
+            "Montant": pd.to_numeric(df[value_col], errors="coerce").fillna(0).astype("float64").to_numpy(),
+            "Litres": (pd.to_numeric(df["Litres"], errors="coerce").fillna(0).astype("float64").to_numpy()
+                       if is_fuel and "Litres" in df.columns else 0.0),
+        }))
+    if not parts:
+        return pd.DataFrame(columns=CUBE_DIMS + ["Montant", "Litres"])
+    rows = pd.concat(parts, ignore_index=True)
+    df_parc = dfs["Parc_Véhicules"].dropna(subset=["Immatriculation"]).drop_duplicates("Immatriculation")
+    directions = pd.Series(df_parc["Direction"].to_numpy(), index=df_parc["Immatriculation"].astype(str))
+    rows["Direction"] = rows["Immatriculation"].map(directions)
+    cube = (rows.groupby(CUBE_DIMS, dropna=False, sort=True)[["Montant", "Litres"]].sum().reset_index())
+    cube["Immatriculation"] = pd.Categorical(cube["Immatriculation"], ordered=True)
+    return cube
+
+# Lignes du cube d'un véhicule : recherche dichotomique sur les codes (le cube est trié par véhicule)
+def cube_for_vehicle(cube, vehicle):
+    vehicles = cube["Immatriculation"].cat
+    code = vehicles.categories.get_indexer([str(vehicle)])[0]
+    if code < 0:
+        return cube.iloc[0:0]
+    start, stop = np.searchsorted(vehicles.codes.to_numpy(), [code, code + 1])
+    return cube.iloc[start:stop]
+
+# Filtre période (granularité mois, les lignes sans date restent incluses) et Directions sur le cube
+def slice_cube(cube, start=None, end=None, directions=None):
+    mask = np.ones(len(cube), dtype=bool)
+    months = cube["Mois"]
+    if start is not None:
+        mask &= (months >= pd.Timestamp(start).to_period("M").to_timestamp()).to_numpy() | months.isna().to_numpy()
+    if end is not None:
+        mask &= (months <= pd.Timestamp(end).to_period("M").to_timestamp()).to_numpy() | months.isna().to_numpy()
+    if directions is not None:
+        mask &= cube["Direction"].isin(list(directions)).to_numpy()
+    return cube[mask]
+
+# Totaux par catégorie d'un morceau de cube
+def cube_totals(cube_slice):
+    by_category = cube_slice.groupby("Catégorie")["Montant"].sum()
+    return {
+        "total_entretien": by_category.get("Entretien", 0.0),
+        "total_reparations": by_category.get("Réparations internes", 0.0) + by_category.get("Prestations externes", 0.0),
+        "total_achats": by_category.get("Achats", 0.0),
+        "total_litres": cube_slice.loc[cube_slice["Catégorie"] == "Carburant", "Litres"].sum(),
+        "total_carbu_ar": by_category.get("Carburant", 0.0),
+    }
+
+# Séries temporelles des graphiques véhicule (km parcourus, litres) : sommes par jour calculées une fois par
+# véhicule, puis regroupées par jour, semaine ou mois selon la plage affichée pour que le nombre de points
+# envoyés au navigateur reste borné quelle que soit la profondeur de l'historique
+SERIES_FREQS = {"D": "Jour", "W": "Semaine", "M": "Mois"}
+SERIES_MAX_POINTS = 400
+# Au-delà de ce nombre de points, rendu WebGL (Scattergl) au lieu de barres SVG
+SERIES_WEBGL_POINTS = 1000
+
+def daily_series(df, value_col, by=None):
+    df = df.dropna(subset=["Date"])
+    keys = [df["Date"].dt.normalize().rename("Date")]
+    if by is not None:
+        keys.append(df[by].astype(str).rename(by))
+    series = df[value_col].astype(np.float64).groupby(keys, sort=True).sum()
+    return series.reset_index()
+
+# Granularité la plus fine qui garde au plus `max_points` intervalles sur la plage [start, end]
+def choose_series_freq(start, end, max_points=SERIES_MAX_POINTS):
+    days = (pd.Timestamp(end) - pd.Timestamp(start)).days + 1
+    for freq, days_per_bin in (("D", 1), ("W", 7), ("M", 30.4375)):
+        if days / days_per_bin <= max_points:
+            return freq
+    return "M"
+
+# Série quotidienne restreinte à [start, end] puis sommée par intervalle (début de semaine / de mois)
+def resample_series(daily, freq, start=None, end=None):
+    mask = np.ones(len(daily), dtype=bool)
+    if start is not None:
+        mask &= (daily["Date"] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        mask &= (daily["Date"] < pd.Timestamp(end) + pd.Timedelta(days=1)).to_numpy()
+    selected = daily[mask]
+    if freq == "D":
+        return selected.reset_index(drop=True)
+    keys = [selected["Date"].dt.to_period(freq).dt.start_time.rename("Date")]
+    keys += [selected[col] for col in selected.columns[1:-1]]
+    value_col = selected.columns[-1]
+    return selected[value_col].groupby(keys, sort=True).sum().reset_index()
+
+# Moteur de consommation : chaque plein de Carburant est rattaché au relevé de Suivi_Kilométrage le plus proche
+# (jointure as-of par véhicule), la distance depuis le plein précédent donne les L/100 km et Ar/km du plein.
+# Les pleins sans relevé à moins de EFFICIENCY_TOLERANCE ne sont pas mesurés.
+EFFICIENCY_TOLERANCE = pd.Timedelta(days=15)
+# Anomalie : plein dont la consommation s'écarte de plus de EFFICIENCY_Z_MAX écarts-types de la moyenne
+# glissante des EFFICIENCY_WINDOW pleins précédents du même véhicule
+EFFICIENCY_WINDOW = 5
+EFFICIENCY_Z_MAX = 2.5
+
+def build_fuel_efficiency(dfs):
+    df_carbu = dfs["Carburant"].dropna(subset=["Immatriculation", "Date"])
+    df_km = dfs["Suivi_Kilométrage"].dropna(subset=["Immatriculation", "Date"])
+    # Clés en texte, de même type des deux côtés même si une feuille est vide (les catégories d'Immatriculation
+    # diffèrent d'une feuille à l'autre)
+    refuels = pd.DataFrame({
+        "Immatriculation": pd.Series(df_carbu["Immatriculation"].astype(str).to_numpy(), dtype="str"),
+        "Date": df_carbu["Date"].to_numpy(dtype="datetime64[ns]"),
+        "Litres": df_carbu["Litres"].to_numpy(dtype=np.float64),
+        "Total_Ar": df_carbu["Total_Ar"].to_numpy(dtype=np.float64),
+    }).sort_values("Date", kind="stable")
+    readings = pd.DataFrame({
+        "Immatriculation": pd.Series(df_km["Immatriculation"].astype(str).to_numpy(), dtype="str"),
+        "Date_Relevé": df_km["Date"].to_numpy(dtype="datetime64[ns]"),
+        "Kilométrage": df_km["Kilométrage"].to_numpy(dtype=np.float64),
+    }).sort_values("Date_Relevé", kind="stable")
+    refuels = pd.merge_asof(refuels, readings, left_on="Date", right_on="Date_Relevé", by="Immatriculation",
+                            direction="nearest", tolerance=EFFICIENCY_TOLERANCE)
+    refuels = (refuels.dropna(subset=["Kilométrage"])
+               .sort_values(["Immatriculation", "Date"], kind="stable").reset_index(drop=True))
+
+    by_vehicle = refuels.groupby("Immatriculation", sort=False)
+    refuels["Km_Parcourus"] = by_vehicle["Kilométrage"].diff()
+    # Même relevé pour deux pleins (ou compteur qui recule) : pas de distance mesurable
+    measured = refuels["Km_Parcourus"] > 0
+    refuels["L_100km"] = (refuels["Litres"] / refuels["Km_Parcourus"] * 100).where(measured)
+    refuels["Ar_km"] = (refuels["Total_Ar"] / refuels["Km_Parcourus"]).where(measured)
+
+    # Statistiques glissantes sur les pleins précédents (groupby().rolling, sans boucle par véhicule)
+    previous = by_vehicle["L_100km"].shift()
+    rolling = previous.groupby(refuels["Immatriculation"], sort=False).rolling(EFFICIENCY_WINDOW, min_periods=3)
+    mean = rolling.mean().reset_index(level=0, drop=True).reindex(refuels.index)
+    std = rolling.std().reset_index(level=0, drop=True).reindex(refuels.index)
+    refuels["Écart"] = ((refuels["L_100km"] - mean) / std).where(std > 0)
+    refuels["Anomalie"] = refuels["Écart"].abs() > EFFICIENCY_Z_MAX
+    return refuels
+
+# Classement de la flotte par consommation (L/100 km pondérés par la distance), une agrégation groupée
+def fleet_efficiency_ranking(refuels, vehicles=None, start=None, end=None):
+    mask = np.ones(len(refuels), dtype=bool)
+    if vehicles is not None:
+        mask &= refuels["Immatriculation"].isin([str(v) for v in vehicles]).to_numpy()
+    if start is not None:
+        mask &= (refuels["Date"] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        mask &= (refuels["Date"] < pd.Timestamp(end) + pd.Timedelta(days=1)).to_numpy()
+    selected = refuels[mask]
+    measured = selected[selected["L_100km"].notna()]
+    ranking = measured.groupby("Immatriculation").agg(
+        Pleins=("Litres", "size"), Litres=("Litres", "sum"),
+        Km_Parcourus=("Km_Parcourus", "sum"), Total_Ar=("Total_Ar", "sum"))
+    ranking["Anomalies"] = selected.groupby("Immatriculation")["Anomalie"].sum().reindex(ranking.index, fill_value=0)
+    return rank_efficiency(ranking.reset_index())
+
+# Ratios et rang à partir des sommes par véhicule (Pleins, Litres, Km_Parcourus, Total_Ar, Anomalies)
+def rank_efficiency(totals):
+    ranking = totals.copy()
+    ranking["L_100km"] = ranking["Litres"] / ranking["Km_Parcourus"] * 100
+    ranking["Ar_km"] = ranking["Total_Ar"] / ranking["Km_Parcourus"]
+    ranking = ranking[["Immatriculation", "Pleins", "Litres", "Km_Parcourus", "Total_Ar", "L_100km", "Ar_km", "Anomalies"]]
+    ranking = ranking.sort_values("L_100km", ascending=False).reset_index(drop=True)
+    ranking.insert(0, "Rang", np.arange(1, len(ranking) + 1))
+    return ranking
+
+# Index de conformité, construit une fois par jeu de données sans modifier les feuilles : dernière fin de
+# couverture d'assurance par véhicule triée par échéance, et visites techniques "Expiré" par véhicule
+def build_compliance_index(dfs):
+    df_ass = dfs["Assurance"].dropna(subset=["Immatriculation"])
+    if "Date_Fin" in df_ass.columns:
+        ends = pd.to_datetime(df_ass["Date_Fin"]).dt.normalize().astype("datetime64[ns]")
+        latest = ends.groupby(df_ass["Immatriculation"].astype(str).to_numpy()).max().dropna().sort_values()
+    else:
+        latest = pd.Series(dtype="datetime64[ns]")
+    df_vt = dfs["Visite_Technique"].dropna(subset=["Immatriculation"])
+    if "Etat" in df_vt.columns:
+        vt_expired = (df_vt["Etat"] == "Expiré").groupby(df_vt["Immatriculation"].astype(str).to_numpy()).sum()
+        vt_expired = vt_expired[vt_expired > 0]
+    else:
+        vt_expired = pd.Series(dtype="int64")
+    return {
+        "assurance": pd.DataFrame({"Immatriculation": latest.index.to_numpy(dtype=object), "Date_Fin": latest.to_numpy()}),
+        "fins_assurance": latest.to_numpy(),
+        "visites_expirees": pd.DataFrame({"Immatriculation": vt_expired.index.to_numpy(dtype=object),
+                                          "Visites_Expirées": vt_expired.to_numpy()}),
+    }
+
+# Alertes de la flotte : assurances expirées / expirant sous `days` jours par dichotomie sur l'index trié
+def compliance_alerts(index, today, days, vehicles=None):
+    today = pd.Timestamp(today).normalize().to_datetime64()
+    ends = index["fins_assurance"]
+    expired_end = np.searchsorted(ends, today, side="left")
+    expiring_end = np.searchsorted(ends, today + np.timedelta64(int(days), "D"), side="right")
+    alerts = {
+        "expirees": index["assurance"].iloc[:expired_end],
+        "a_renouveler": index["assurance"].iloc[expired_end:expiring_end],
+        "visites_expirees": index["visites_expirees"],
+    }
+    for key, df in alerts.items():
+        if vehicles is not None:
+            df = df[df["Immatriculation"].isin([str(v) for v in vehicles])]
+        if "Date_Fin" in df.columns:
+            df = df.assign(Jours=(df["Date_Fin"] - today).dt.days)
+        alerts[key] = df
+    return alerts
+
+# Dernier relevé kilométrique de chaque véhicule : relevé daté le plus récent dont le kilométrage est renseigné
+# (à date égale, le dernier dans l'ordre de la feuille) ; les relevés sans date sont ignorés
+def last_readings(df_km):
+    df_km = df_km.dropna(subset=["Immatriculation", "Date", "Kilométrage"])
+    return (df_km.sort_values("Date", kind="stable")
+            .groupby(df_km["Immatriculation"].astype(str), sort=False)["Kilométrage"].last())
+
+# KPIs d'un véhicule : kilométrage depuis ses relevés (cf. select_vehicle_rows), coûts depuis sa part du cube
+def compute_vehicle_kpis(vehicle_frames, vehicle_cube):
+    df_km = vehicle_frames.get("Suivi_Kilométrage", pd.DataFrame())
+    kpis = cube_totals(vehicle_cube)
+    last_km = last_readings(df_km) if not df_km.empty else pd.Series(dtype="float64")
+    kpis["dernier_km"] = last_km.iloc[0] if len(last_km) else 0
+    kpis["cout_total_veh"] = kpis["total_entretien"] + kpis["total_reparations"] + kpis["total_achats"]
+    return kpis
+
+# Colonnes de coûts du cube -> clés KPI (mêmes regroupements que cube_totals)
+FLEET_KPI_CATEGORIES = {
+    "Entretien": "total_entretien",
+    "Réparations internes": "total_reparations",
+    "Prestations externes": "total_reparations",
+    "Achats": "total_achats",
+    "Carburant": "total_carbu_ar",
+}
+FLEET_KPI_COLUMNS = ["Immatriculation", "Direction", "dernier_km", "total_entretien", "total_reparations",
+                     "total_achats", "cout_total_veh", "total_litres", "total_carbu_ar", "cout_total_global",
+                     "fin_assurance", "visites_expirees"]
+
+# KPIs de tous les véhicules en une passe groupée (mêmes valeurs que compute_vehicle_kpis véhicule par véhicule) :
+# kilométrage = dernier relevé, coûts et litres depuis le cube filtré sur la période et les Directions
+def compute_fleet_kpis(dfs, cube=None, start=None, end=None, directions=None, compliance=None):
+    parc = dfs["Parc_Véhicules"]
+    if directions:
+        parc = parc[parc["Direction"].isin(directions)]
+    last_km = last_readings(dfs["Suivi_Kilométrage"])
+    if cube is None:
+        cube = build_cost_cube(dfs)
+    if compliance is None:
+        compliance = build_compliance_index(dfs)
+    return assemble_fleet_kpis(parc, last_km, slice_cube(cube, start, end), compliance)
+
+# Tableau des KPIs de la flotte à partir des agrégats (partagé avec fleet_sqlite.query_fleet_kpis) : `last_km`
+# indexé par Immatriculation, `cube_slice` avec au moins Immatriculation, Catégorie, Montant et Litres
+def assemble_fleet_kpis(parc, last_km, cube_slice, compliance):
+    parc = parc.dropna(subset=["Immatriculation"]).drop_duplicates("Immatriculation")
+    vehicles = pd.Index(parc["Immatriculation"].astype(str).to_numpy(), name="Immatriculation")
+    kpis = pd.DataFrame({"Direction": parc["Direction"].astype(str).to_numpy()}, index=vehicles)
+    # int64 / float64 quel que soit le type compact de la feuille (mêmes types en mémoire et depuis SQLite)
+    last_km = last_km.reindex(vehicles).fillna(0).to_numpy()
+    kpis["dernier_km"] = last_km.astype(np.int64 if np.issubdtype(last_km.dtype, np.integer) else np.float64)
+
+    keys = cube_slice["Immatriculation"].astype(str).to_numpy()
+    amounts = (cube_slice.groupby([keys, cube_slice["Catégorie"].map(FLEET_KPI_CATEGORIES).to_numpy()])["Montant"]
+               .sum().unstack(fill_value=0.0))
+    for column in dict.fromkeys(FLEET_KPI_CATEGORIES.values()):
+        kpis[column] = amounts[column].reindex(vehicles).fillna(0.0).to_numpy() if column in amounts else 0.0
+    fuel = cube_slice["Catégorie"].to_numpy() == "Carburant"
+    kpis["total_litres"] = cube_slice["Litres"][fuel].groupby(keys[fuel]).sum().reindex(vehicles).fillna(0.0).to_numpy()
+    kpis["cout_total_veh"] = kpis["total_entretien"] + kpis["total_reparations"] + kpis["total_achats"]
+    kpis["cout_total_global"] = kpis["cout_total_veh"] + kpis["total_carbu_ar"]
+
+    kpis["fin_assurance"] = compliance["assurance"].set_index("Immatriculation")["Date_Fin"].reindex(vehicles).to_numpy()
+    expired = compliance["visites_expirees"].set_index("Immatriculation")["Visites_Expirées"]
+    kpis["visites_expirees"] = expired.reindex(vehicles).fillna(0).astype("int64").to_numpy()
+    return kpis.reset_index()[FLEET_KPI_COLUMNS]
+
+def format_period_fr(start, end):
+    return f"{format_date_fr(pd.Timestamp(start))} - {format_date_fr(pd.Timestamp(end))}"
+
+# Tableau "Résumé" du rapport (une ligne, valeurs déjà formatées)
+def build_resume(vehicle, direction, kpis, today, period):
+    return pd.DataFrame([{
+        "Immatriculation": vehicle,
+        "Direction": direction,
+        "Période": format_period_fr(*period),
+        "Kilométrage Actuel": f"{int(kpis['dernier_km']):,}".replace(",", " ") + " km",
+        "Coût Entretien": f"{kpis['total_entretien']:,.0f}".replace(",", " ") + " Ar",
+        "Coût Réparations": f"{kpis['total_reparations']:,.0f}".replace(",", " ") + " Ar",
+        "Coût Achats": f"{kpis['total_achats']:,.0f}".replace(",", " ") + " Ar",
+        "Coût Total Mécanique": f"{kpis['cout_total_veh']:,.0f}".replace(",", " ") + " Ar",
+        "Total Litres Carburant": f"{kpis['total_litres']:,.1f}".replace(",", " ") + " L",
+        "Coût Carburant": f"{kpis['total_carbu_ar']:,.0f}".replace(",", " ") + " Ar",
+        "Coût Total Global": f"{kpis['cout_total_veh'] + kpis['total_carbu_ar']:,.0f}".replace(",", " ") + " Ar",
+        "Date Rapport": format_date_fr(today.date())
+    }])
+
+# Feuilles exportées dans le rapport véhicule et leurs formats de colonnes
+REPORT_SHEETS = ["Entretien", "Réparations Internes", "Prestation externe", "Assurance", "Visite_Technique",
+                 "Achats", "Carburant", "Suivi_Kilométrage"]
+SHEETS_MONEY = {
+    "Entretien": ["Coût_Total"],
+    "Réparations Internes": ["Coût_Total"],
+    "Prestation externe": ["Coût_Total"],  # Corrigé "Prestations Externes"
+    "Assurance": ["Montant"],
+    "Achats": ["Prix_Unitaire", "Prix_Total"],
+    "Carburant": ["Prix_Litre", "Total_Ar"],
+    "Suivi_Kilométrage": []  # Renommé pour cohérence
+}
+SHEETS_LITER = {
+    "Carburant": ["Litres"]
+}
+
+# Formats communs aux exports Excel (rapport véhicule, export complet de fleet_export)
+def add_report_formats(workbook):
+    return {
+        "header": workbook.add_format({'bold': True, 'text_wrap': True, 'valign': 'top', 'fg_color': '#D7E4BC'}),
+        "money": workbook.add_format({'num_format': '# ##0 "Ar"'}),  # Espaces au lieu de virgules
+        "liter": workbook.add_format({'num_format': '#,##0.0 "L"'}),  # Format avec "L"
+    }
+
+# Export Excel d'un véhicule (avec format Ar et L, espaces pour milliers) ; renvoie le contenu du .xlsx
+def build_vehicle_report(vehicle, vehicle_frames, vehicle_cube, df_vehicules, today, period):
+    kpis = compute_vehicle_kpis(vehicle_frames, vehicle_cube)
+    df_parc = vehicle_frames.get("Parc_Véhicules", pd.DataFrame())
+    direction = df_parc["Direction"].iloc[0] if not df_parc.empty else ""
+    df_resume = build_resume(vehicle, direction, kpis, today, period)
+
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
+        formats = add_report_formats(writer.book)
+        header_format, money_format, liter_format = formats["header"], formats["money"], formats["liter"]
+
+        df_resume.to_excel(writer, sheet_name="Résumé", index=False)
+        worksheet = writer.sheets["Résumé"]
+        for col_num, value in enumerate(df_resume.columns.values):
+            worksheet.write(0, col_num, value, header_format)
+        # Appliquer formats aux colonnes
+        for col in ["Coût Entretien", "Coût Réparations", "Coût Achats", "Coût Total Mécanique", "Coût Carburant", "Coût Total Global"]:
+            col_idx = list(df_resume.columns).index(col) + 1
+            worksheet.set_column(col_idx, col_idx, None, money_format)
+        for col in ["Total Litres Carburant"]:
+            col_idx = list(df_resume.columns).index(col) + 1
+            worksheet.set_column(col_idx, col_idx, None, liter_format)
+
+        # Pour les autres feuilles
+        sheets = [(name, vehicle_frames.get(name, pd.DataFrame())) for name in REPORT_SHEETS]
+        for sheet_name, df_sheet_orig in sheets + [("Parc_Véhicules", df_vehicules)]:
+            df_sheet = df_sheet_orig.copy()
+            # Formater les dates en texte français pour l'export
+            date_cols = df_sheet.select_dtypes(include=['datetime64[ns]']).columns
+            for col in date_cols:
+                df_sheet[col] = format_dates_fr(df_sheet[col])
+            df_sheet.to_excel(writer, sheet_name=sheet_name, index=False)
+            ws = writer.sheets[sheet_name]
+            for col in SHEETS_MONEY.get(sheet_name, []):
+                if col in df_sheet.columns:
+                    col_idx = list(df_sheet.columns).index(col) + 1
+                    ws.set_column(col_idx, col_idx, None, money_format)
+            for col in SHEETS_LITER.get(sheet_name, []):
+                if col in df_sheet.columns:
+                    col_idx = list(df_sheet.columns).index(col) + 1
+                    ws.set_column(col_idx, col_idx, None, liter_format)
+    return buffer.getvalue()
+
+def report_file_name(vehicle, today):
+    return f"Rapport_{vehicle}_{today.date().strftime('%Y%m%d')}.xlsx"
+
+# Parc_Véhicules est commun à tous les rapports : envoyé une fois par worker plutôt qu'à chaque tâche
+_worker_parc = None
+
+def _init_report_worker(df_vehicules):
+    global _worker_parc
+    _worker_parc = df_vehicules
+
+def _report_task(vehicle, vehicle_frames, vehicle_cube, today, period):
+    return report_file_name(vehicle, today), build_vehicle_report(vehicle, vehicle_frames, vehicle_cube, _worker_parc,
+                                                                  today, period)
+
+# Mode lot : rapports de plusieurs véhicules générés dans un process pool (xlsxwriter est en pur Python,
+# donc limité par le GIL en threads) et regroupés dans une seule archive zip
+def build_reports_zip(vehicle_frames_by_vehicle, cube, df_vehicules, today, period, max_workers=None):
+    vehicles = list(vehicle_frames_by_vehicle)
+    tasks = [(v, vehicle_frames_by_vehicle[v], cube_for_vehicle(cube, v), today, period) for v in vehicles]
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        if len(vehicles) <= 1 or max_workers == 1:
+            _init_report_worker(df_vehicules)
+            for name, content in (_report_task(*task) for task in tasks):
+                archive.writestr(name, content)
+        else:
+            # "spawn" : pas de fork d'un serveur multi-thread (Streamlit)
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                     initializer=_init_report_worker, initargs=(df_vehicules,)) as pool:
+                for name, content in pool.map(_report_task, *zip(*tasks)):
+                    archive.writestr(name, content)
+    return buffer.getvalue()
@@ -0,0 +1,148 @@
+# Export complet des données filtrées (Directions, période) sans copie intégrale en mémoire : les feuilles sont
+# lues par morceaux de lignes et écrites au fil de l'eau dans un fichier temporaire — Excel (xlsxwriter en mode
+# constant_memory, mêmes formats Ar / L que le rapport véhicule), CSV zippés ou Parquet zippés.
+# Indépendant de Streamlit ; les morceaux viennent des DataFrames en mémoire ou de la base SQLite.
+import os
+import tempfile
+import time
+import zipfile
+from io import TextIOWrapper
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import xlsxwriter
+from fleet_core import (REQUIRED_SHEETS, COST_DATE_COLS, SHEETS_MONEY, SHEETS_LITER, format_dates_fr,
+                        add_report_formats)
+
+EXPORT_CHUNK_ROWS = 50_000
+EXPORT_FORMATS = {"xlsx": "Excel (.xlsx)", "csv": "CSV zippés (.zip)", "parquet": "Parquet zippés (.zip)"}
+EXPORT_MIME = {"xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+               "csv": "application/zip", "parquet": "application/zip"}
+# Dossier des exports temporaires : les fichiers de plus de EXPORT_MAX_AGE_S secondes (session terminée, export
+# jamais téléchargé) sont supprimés à chaque nouvel export
+EXPORT_DIR = Path(os.environ.get("SUIVI_EXPORT_DIR", Path(tempfile.gettempdir()) / "suivi_exports"))
+EXPORT_MAX_AGE_S = int(os.environ.get("SUIVI_EXPORT_MAX_AGE_S", "3600"))
+
+def export_date_col(sheet, columns):
+    date_col = COST_DATE_COLS.get(sheet, "Date")
+    return date_col if date_col in columns else None
+
+# Morceaux d'une feuille en mémoire : positions des lignes retenues (véhicules des Directions, période ;
+# lignes sans date conservées), puis découpage sans copier la feuille entière
+def memory_chunks(dfs, directions=None, start=None, end=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    df_parc = dfs["Parc_Véhicules"]
+    if directions is not None:
+        df_parc = df_parc[df_parc["Direction"].isin(list(directions))]
+    vehicles = df_parc["Immatriculation"].dropna().astype(str).unique()
+
+    def chunks(sheet):
+        df = dfs[sheet]
+        mask = np.ones(len(df), dtype=bool)
+        if "Immatriculation" in df.columns:
+            mask &= df["Immatriculation"].astype(str).isin(vehicles).to_numpy()
+        date_col = export_date_col(sheet, df.columns)
+        if date_col:
+            dates = pd.to_datetime(df[date_col])
+            if start is not None:
+                mask &= ((dates >= pd.Timestamp(start)) | dates.isna()).to_numpy()
+            if end is not None:
+                mask &= ((dates < pd.Timestamp(end) + pd.Timedelta(days=1)) | dates.isna()).to_numpy()
+        positions = np.flatnonzero(mask)
+        if not len(positions):
+            yield df.iloc[0:0]
+        for i in range(0, len(positions), chunk_rows):
+            yield df.iloc[positions[i:i + chunk_rows]]
+    return chunks
+
+# Cellules prêtes pour xlsxwriter : dates en texte français (comme le rapport), manquants -> None (cellule vide)
+def _excel_rows(chunk):
+    chunk = chunk.copy()
+    for col in chunk.select_dtypes(include=['datetime64[ns]']).columns:
+        chunk[col] = format_dates_fr(chunk[col])
+    values = chunk.astype(object).where(chunk.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+def _write_xlsx(path, chunks, sheets):
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "tmpdir": os.path.dirname(path)})
+    formats = add_report_formats(workbook)
+    for sheet in sheets:
+        worksheet = workbook.add_worksheet(sheet)
+        row = 0
+        for chunk in chunks(sheet):
+            if row == 0:
+                # Formats de colonnes posés avant les lignes : appliqués aux cellules écrites sans format
+                columns = list(chunk.columns)
+                for col in SHEETS_MONEY.get(sheet, []):
+                    if col in columns:
+                        worksheet.set_column(columns.index(col), columns.index(col), None, formats["money"])
+                for col in SHEETS_LITER.get(sheet, []):
+                    if col in columns:
+                        worksheet.set_column(columns.index(col), columns.index(col), None, formats["liter"])
+                worksheet.write_row(0, 0, [str(col) for col in columns], formats["header"])
+                row = 1
+            for values in _excel_rows(chunk):
+                worksheet.write_row(row, 0, values)
+                row += 1
+    workbook.close()
+
+def _write_csv_zip(path, chunks, sheets):
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for sheet in sheets:
+            with archive.open(f"{sheet}.csv", "w") as raw, TextIOWrapper(raw, encoding="utf-8-sig", newline="") as out:
+                header = True
+                for chunk in chunks(sheet):
+                    chunk.to_csv(out, index=False, header=header, date_format="%Y-%m-%d")
+                    header = False
+
+def _write_parquet_zip(path, chunks, sheets):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as archive:
+        for sheet in sheets:
+            fd, part = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".parquet")
+            os.close(fd)
+            try:
+                writer = None
+                for chunk in chunks(sheet):
+                    # Texte et catégories en chaînes : schéma identique d'un morceau à l'autre
+                    chunk = chunk.astype({col: "str" for col in chunk.columns
+                                          if not pd.api.types.is_numeric_dtype(chunk[col])
+                                          and not pd.api.types.is_datetime64_any_dtype(chunk[col])})
+                    if writer is None:
+                        schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                        writer = pq.ParquetWriter(part, schema)
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False, safe=False))
+                if writer is not None:
+                    writer.close()
+                archive.write(part, f"{sheet}.parquet")
+            finally:
+                os.unlink(part)
+
+EXPORT_WRITERS = {"xlsx": _write_xlsx, "csv": _write_csv_zip, "parquet": _write_parquet_zip}
+
+def purge_exports(tmpdir=None, max_age=EXPORT_MAX_AGE_S):
+    limit = time.time() - max_age
+    for entry in Path(tmpdir or EXPORT_DIR).glob("export-*"):
+        try:
+            if entry.stat().st_mtime < limit:
+                entry.unlink()
+        except OSError:
+            pass
+
+# Export complet dans un fichier temporaire (à supprimer par l'appelant, sinon purgé après EXPORT_MAX_AGE_S) ;
+# `chunks(sheet)` fournit les morceaux d'une feuille (memory_chunks ou fleet_sqlite.sqlite_chunks)
+def export_dataset(chunks, fmt="xlsx", sheets=None, tmpdir=None):
+    tmpdir = Path(tmpdir or EXPORT_DIR)
+    tmpdir.mkdir(parents=True, exist_ok=True)
+    purge_exports(tmpdir)
+    fd, path = tempfile.mkstemp(dir=tmpdir, prefix="export-", suffix=".xlsx" if fmt == "xlsx" else ".zip")
+    os.close(fd)
+    try:
+        EXPORT_WRITERS[fmt](path, chunks, sheets or REQUIRED_SHEETS)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+def export_file_name(fmt, scope, today):
+    return f"Export_{scope.replace(' ', '_')}_{today.date().strftime('%Y%m%d')}{'.xlsx' if fmt == 'xlsx' else '.zip'}"
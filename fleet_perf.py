@@ -0,0 +1,114 @@
+# Instrumentation des performances, indépendante de Streamlit : durée et variation de mémoire de chaque étape
+# d'une exécution du script, appels / recalculs des fonctions en cache, et export des traces en JSON lines.
+# La trace courante est propre au thread d'exécution (une session Streamlit = un thread de script).
+import datetime as dt
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+TRACE_FILE = Path(os.environ.get("SUIVI_TRACE_FILE", "traces_perf.jsonl"))
+
+_local = threading.local()
+
+# Mémoire résidente actuelle du processus (Linux : /proc/self/statm ; ailleurs, pic de mémoire faute de mieux)
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# Démarrer la trace d'une exécution (remplace la précédente pour ce thread)
+def start_trace(**context):
+    trace = {
+        "horodatage": dt.datetime.now().isoformat(timespec="milliseconds"),
+        "contexte": dict(context),
+        "etapes": {},
+        "caches": {},
+        "_t0": time.perf_counter(),
+        "_rss0": current_rss(),
+    }
+    _local.trace = trace
+    return trace
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+# Étape chronométrée ; les appels répétés d'une même étape sont cumulés. Sans trace en cours, ne mesure rien.
+@contextmanager
+def stage(name):
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    rss_before = current_rss()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = trace["etapes"].setdefault(name, {"secondes": 0.0, "appels": 0, "memoire_octets": 0})
+        entry["secondes"] += time.perf_counter() - t0
+        entry["appels"] += 1
+        entry["memoire_octets"] += current_rss() - rss_before
+
+def timed(name):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _cache_entry(name):
+    trace = current_trace()
+    if trace is None:
+        return None
+    return trace["caches"].setdefault(name, {"appels": 0, "recalculs": 0})
+
+# Compteurs de cache : le décorateur externe compte les appels, count_miss (dans le corps de la fonction
+# en cache, exécuté seulement quand le résultat n'est pas en cache) compte les recalculs
+def count_calls(name):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            entry = _cache_entry(name)
+            if entry is not None:
+                entry["appels"] += 1
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count_miss(name):
+    entry = _cache_entry(name)
+    if entry is not None:
+        entry["recalculs"] += 1
+
+# Clôturer la trace courante : enregistrement sérialisable (durées en secondes, mémoire en octets)
+def finish_trace(**context):
+    trace = current_trace()
+    if trace is None:
+        return None
+    _local.trace = None
+    rss = current_rss()
+    return {
+        "horodatage": trace["horodatage"],
+        "contexte": {**trace["contexte"], **context},
+        "duree_totale_s": round(time.perf_counter() - trace["_t0"], 6),
+        "rss_octets": rss,
+        "variation_rss_octets": rss - trace["_rss0"],
+        "etapes": {name: {**entry, "secondes": round(entry["secondes"], 6)} for name, entry in trace["etapes"].items()},
+        "caches": {name: {**entry, "hits": entry["appels"] - entry["recalculs"]} for name, entry in trace["caches"].items()},
+    }
+
+# Ajouter un enregistrement à un fichier JSON lines (une ligne par exécution)
+def append_trace(record, path=None):
+    path = Path(path or TRACE_FILE)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    return path
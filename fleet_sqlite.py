@@ -0,0 +1,287 @@
+# Stockage SQLite optionnel : les feuilles nettoyées et les tables dérivées (cube de coûts, consommation,
+# conformité) sont écrites une fois dans un fichier SQLite local indexé sur Immatriculation, Date et Direction.
+# Le tableau de bord n'en relit que les lignes et agrégats affichés : la mémoire d'un worker ne dépend plus
+# de la profondeur de l'historique. Indépendant de Streamlit.
+import os
+import sqlite3
+import tempfile
+from contextlib import closing
+from pathlib import Path
+import pandas as pd
+from fleet_export import EXPORT_CHUNK_ROWS, export_date_col
+from fleet_core import (SHEET_SCHEMA, COST_DATE_COLS, CUBE_DIMS, CACHE_SQLITE_DIR, _cache_root, evict_cache,
+                        build_cost_cube, build_fuel_efficiency, build_compliance_index, rank_efficiency,
+                        assemble_fleet_kpis)
+
+# Tables dérivées matérialisées à l'ingestion : nom -> colonnes dates
+DERIVED_TABLES = {
+    "cube_couts": ["Mois"],
+    "consommation": ["Date", "Date_Relevé"],
+    "conformite_assurance": ["Date_Fin"],
+    "conformite_visites": [],
+}
+SQL_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def sqlite_path(file_hash):
+    return _cache_root() / CACHE_SQLITE_DIR / f"{file_hash}.sqlite"
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _sql_date(value):
+    return pd.Timestamp(value).strftime(SQL_DATE_FORMAT)
+
+def _date_columns(table, columns):
+    declared = DERIVED_TABLES.get(table, SHEET_SCHEMA.get(table, {}).get("dates", []))
+    return [col for col in columns if col in declared or str(col).startswith("Date")]
+
+# Dates en texte ISO (comparables dans les index), catégories en texte
+def _to_sql_frame(df):
+    out = {}
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            out[col] = series.dt.strftime(SQL_DATE_FORMAT).astype(object).where(series.notna(), None)
+        elif isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(series):
+            out[col] = series.astype(object).where(series.notna(), None)
+        else:
+            out[col] = series
+    return pd.DataFrame(out, index=df.index)
+
+def _write_table(con, table, df, indexes):
+    df = _to_sql_frame(df)
+    columns = ", ".join(_quote(col) for col in df.columns)
+    con.execute(f"CREATE TABLE {_quote(table)} ({columns})")
+    placeholders = ", ".join("?" * len(df.columns))
+    con.executemany(f"INSERT INTO {_quote(table)} VALUES ({placeholders})",
+                    df.itertuples(index=False, name=None))
+    for i, cols in enumerate(indexes):
+        cols = [col for col in cols if col in df.columns]
+        if cols:
+            con.execute(f"CREATE INDEX {_quote(f'idx_{table}_{i}')} ON {_quote(table)} "
+                        f"({', '.join(_quote(col) for col in cols)})")
+
+def _sheet_indexes(sheet, df):
+    date_col = COST_DATE_COLS.get(sheet, "Date")
+    indexes = []
+    if "Immatriculation" in df.columns:
+        indexes.append(["Immatriculation", date_col] if date_col in df.columns else ["Immatriculation"])
+    if date_col in df.columns:
+        indexes.append([date_col])
+    if "Direction" in df.columns:
+        indexes.append(["Direction"])
+    return indexes
+
+# Ingestion : feuilles nettoyées (`load()`, appelé seulement si la base n'existe pas encore) et tables dérivées
+# écrites dans un fichier temporaire puis renommé (un autre worker ne voit jamais une base incomplète).
+# La base compte dans la taille maximale du cache disque (éviction LRU, cf. fleet_core.evict_cache) : à appeler
+# à chaque utilisation, pour la marquer récemment utilisée ou la reconstruire si elle a été évincée.
+def build_sqlite_store(file_hash, load):
+    path = sqlite_path(file_hash)
+    try:
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    dfs = load()
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".sqlite")
+    os.close(fd)
+    try:
+        with closing(sqlite3.connect(tmp_name)) as con:
+            con.execute("PRAGMA journal_mode = OFF")
+            con.execute("PRAGMA synchronous = OFF")
+            for sheet, df in dfs.items():
+                # Feuille vierge (ex. "Feuil1") : pas de table sans colonnes en SQLite
+                if len(df.columns):
+                    _write_table(con, sheet, df, _sheet_indexes(sheet, df))
+            _write_table(con, "cube_couts", build_cost_cube(dfs),
+                         [["Immatriculation", "Mois"], ["Mois", "Direction"]])
+            _write_table(con, "consommation", build_fuel_efficiency(dfs), [["Immatriculation", "Date"], ["Date"]])
+            compliance = build_compliance_index(dfs)
+            _write_table(con, "conformite_assurance", compliance["assurance"], [["Date_Fin"]])
+            _write_table(con, "conformite_visites", compliance["visites_expirees"], [])
+            con.commit()
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    evict_cache(keep=file_hash)
+    return path
+
+# Connexion en lecture seule, ouverte le temps d'une requête (sans partage entre threads de session)
+def _connect(db):
+    return closing(sqlite3.connect(f"file:{Path(db).resolve()}?mode=ro", uri=True))
+
+def _parse_dates(df, table):
+    for col in _date_columns(table, df.columns) if table else []:
+        df[col] = pd.to_datetime(df[col]).astype("datetime64[ns]")
+    return df
+
+def query(db, sql, params=(), table=None):
+    with _connect(db) as con:
+        df = pd.read_sql_query(sql, con, params=list(params))
+    return _parse_dates(df, table)
+
+def read_table(db, table, where="", params=()):
+    return query(db, f"SELECT * FROM {_quote(table)} {where}", params, table)
+
+def table_names(db):
+    with _connect(db) as con:
+        rows = con.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    return [name for (name,) in rows if name not in DERIVED_TABLES]
+
+def sheet_row_counts(db):
+    with _connect(db) as con:
+        return {name: con.execute(f"SELECT COUNT(*) FROM {_quote(name)}").fetchone()[0] for name in table_names(db)}
+
+def _vehicle_sheets(db):
+    with _connect(db) as con:
+        return [name for name in table_names(db)
+                if any(row[1] == "Immatriculation" for row in con.execute(f"PRAGMA table_info({_quote(name)})"))]
+
+# Première et dernière opération de la base (cf. fleet_core.data_date_range), lues par les index de dates
+def query_date_range(db):
+    first = last = None
+    with _connect(db) as con:
+        for sheet in table_names(db):
+            columns = [row[1] for row in con.execute(f"PRAGMA table_info({_quote(sheet)})")]
+            date_col = COST_DATE_COLS.get(sheet, "Date")
+            if date_col not in columns:
+                continue
+            sheet_first, sheet_last = con.execute(
+                f"SELECT MIN({_quote(date_col)}), MAX({_quote(date_col)}) FROM {_quote(sheet)}").fetchone()
+            if sheet_first is not None:
+                first = min(first or sheet_first, sheet_first)
+                last = max(last or sheet_last, sheet_last)
+    return (pd.Timestamp(first), pd.Timestamp(last)) if first is not None else (None, None)
+
+# Lignes d'un véhicule dans chaque feuille (équivalent de select_vehicle_rows, via l'index Immatriculation)
+def query_vehicle_frames(db, vehicle):
+    return {sheet: read_table(db, sheet, "WHERE Immatriculation = ? ORDER BY rowid", [str(vehicle)]) for sheet in _vehicle_sheets(db)}
+
+def _direction_filter(directions, column="Direction"):
+    if directions is None:
+        return "", []
+    directions = [str(d) for d in directions]
+    return f" AND {column} IN ({', '.join('?' * len(directions))})", directions
+
+def _period_filter(start, end, column):
+    clause, params = "", []
+    if start is not None:
+        clause += f" AND {column} >= ?"
+        params.append(_sql_date(pd.Timestamp(start)))
+    if end is not None:
+        clause += f" AND {column} < ?"
+        params.append(_sql_date(pd.Timestamp(end) + pd.Timedelta(days=1)))
+    return clause, params
+
+def _month_filter(start, end):
+    clause, params = "", []
+    if start is not None:
+        clause += " AND (Mois IS NULL OR Mois >= ?)"
+        params.append(_sql_date(pd.Timestamp(start).to_period("M").to_timestamp()))
+    if end is not None:
+        clause += " AND (Mois IS NULL OR Mois <= ?)"
+        params.append(_sql_date(pd.Timestamp(end).to_period("M").to_timestamp()))
+    return clause, params
+
+# Lignes du cube sur une période (granularité mois, lignes sans date incluses comme slice_cube)
+def query_cube(db, start=None, end=None, directions=None, vehicle=None):
+    clause, params = _month_filter(start, end)
+    dir_clause, dir_params = _direction_filter(directions)
+    if vehicle is not None:
+        clause += " AND Immatriculation = ?"
+        params.append(str(vehicle))
+    return read_table(db, "cube_couts", f"WHERE 1 = 1{clause}{dir_clause} ORDER BY Immatriculation",
+                      params + dir_params)
+
+# Cube agrégé par Direction / catégorie / type de carburant sur une période : assez pour le tableau global
+# (slice_cube par Directions, cube_totals, regroupements par Direction et par type), sans une ligne par véhicule
+def query_cube_summary(db, start=None, end=None):
+    clause, params = _month_filter(start, end)
+    group = ", ".join(_quote(dim) for dim in CUBE_DIMS if dim not in ("Immatriculation", "Mois"))
+    return query(db, f"SELECT NULL AS Mois, {group}, SUM(Montant) AS Montant, SUM(Litres) AS Litres "
+                     f"FROM cube_couts WHERE 1 = 1{clause} GROUP BY {group}", params)
+
+# Index de conformité (même forme que build_compliance_index), lu dans les tables matérialisées
+def query_compliance_index(db):
+    assurance = read_table(db, "conformite_assurance", "ORDER BY Date_Fin")
+    return {
+        "assurance": assurance,
+        "fins_assurance": assurance["Date_Fin"].to_numpy(),
+        "visites_expirees": read_table(db, "conformite_visites"),
+    }
+
+# Classement de consommation (cf. fleet_efficiency_ranking) : sommes par véhicule calculées par SQLite
+def query_efficiency_ranking(db, directions=None, start=None, end=None):
+    clause, params = _period_filter(start, end, "c.Date")
+    dir_clause, dir_params = _direction_filter(directions, "p.Direction")
+    totals = query(db, f"""
+        SELECT c.Immatriculation AS Immatriculation, COUNT(*) AS Pleins, SUM(c.Litres) AS Litres,
+               SUM(c.Km_Parcourus) AS Km_Parcourus, SUM(c.Total_Ar) AS Total_Ar,
+               SUM(COALESCE(c.Anomalie, 0)) AS Anomalies
+        FROM consommation c JOIN {_quote("Parc_Véhicules")} p ON p.Immatriculation = c.Immatriculation
+        WHERE c.L_100km IS NOT NULL{clause}{dir_clause}
+        GROUP BY c.Immatriculation""", params + dir_params)
+    return rank_efficiency(totals.astype({"Immatriculation": "str", "Anomalies": "int64"}))
+
+# KPIs de tous les véhicules des Directions sur une période (cf. compute_fleet_kpis) : dernier relevé et sommes
+# du cube par véhicule et catégorie calculés par SQLite, une requête groupée par source
+def query_fleet_kpis(db, start=None, end=None, directions=None):
+    dir_clause, dir_params = _direction_filter(directions)
+    parc = query(db, f"SELECT Immatriculation, Direction FROM {_quote('Parc_Véhicules')} WHERE 1 = 1{dir_clause}",
+                 dir_params)
+    # Dernier relevé daté et renseigné par véhicule, même règle que fleet_core.last_readings
+    last_km = query(db, f"""
+        SELECT Immatriculation, Kilométrage FROM (
+            SELECT Immatriculation, Kilométrage, ROW_NUMBER() OVER (
+                PARTITION BY Immatriculation ORDER BY Date DESC, rowid DESC) AS n
+            FROM {_quote('Suivi_Kilométrage')}
+            WHERE Immatriculation IS NOT NULL AND Date IS NOT NULL AND Kilométrage IS NOT NULL)
+        WHERE n = 1""")
+    clause, params = _month_filter(start, end)
+    cube = query(db, f"SELECT Immatriculation, Catégorie, SUM(Montant) AS Montant, SUM(Litres) AS Litres "
+                     f"FROM cube_couts WHERE 1 = 1{clause} GROUP BY Immatriculation, Catégorie", params)
+    last_km = last_km.set_index(last_km["Immatriculation"].astype(str))["Kilométrage"]
+    return assemble_fleet_kpis(parc, last_km, cube, query_compliance_index(db))
+
+# Données d'un lot de rapports : lignes de chaque véhicule du périmètre et sa part du cube sur la période
+def query_batch(db, vehicles, start=None, end=None):
+    frames = {vehicle: query_vehicle_frames(db, vehicle) for vehicle in vehicles}
+    cube = pd.concat([query_cube(db, start, end, vehicle=vehicle) for vehicle in vehicles], ignore_index=True)
+    # Trié par Immatriculation (cf. build_cost_cube) : cube_for_vehicle cherche les lignes par dichotomie sur les codes
+    cube["Immatriculation"] = cube["Immatriculation"].astype(str)
+    cube = cube.sort_values("Immatriculation", kind="stable", ignore_index=True)
+    cube["Immatriculation"] = pd.Categorical(cube["Immatriculation"], ordered=True)
+    return frames, cube
+
+# Morceaux d'une feuille pour l'export complet (cf. fleet_export.memory_chunks) : filtre Directions / période
+# appliqué par SQLite, lignes lues par paquets de `chunk_rows` sur une connexion ouverte le temps de la feuille
+def sqlite_chunks(db, directions=None, start=None, end=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    def chunks(sheet):
+        with _connect(db) as con:
+            columns = [row[1] for row in con.execute(f"PRAGMA table_info({_quote(sheet)})")]
+            clause, params = "", []
+            if directions is not None:
+                dir_clause, dir_params = _direction_filter(directions)
+                if sheet == "Parc_Véhicules":
+                    clause, params = dir_clause, dir_params
+                elif "Immatriculation" in columns:
+                    clause = (f" AND Immatriculation IN (SELECT Immatriculation FROM {_quote('Parc_Véhicules')}"
+                              f" WHERE 1 = 1{dir_clause})")
+                    params = dir_params
+            date_col = export_date_col(sheet, columns)
+            if date_col:
+                period_clause, period_params = _period_filter(start, end, _quote(date_col))
+                if period_clause:
+                    clause += f" AND ({_quote(date_col)} IS NULL OR (1 = 1{period_clause}))"
+                    params += period_params
+            sql = f"SELECT * FROM {_quote(sheet)} WHERE 1 = 1{clause} ORDER BY rowid"
+            empty = True
+            for chunk in pd.read_sql_query(sql, con, params=params, chunksize=chunk_rows):
+                empty = False
+                yield _parse_dates(chunk, sheet)
+            if empty:
+                yield _parse_dates(pd.DataFrame(columns=columns), sheet)
+    return chunks
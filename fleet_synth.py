@@ -0,0 +1,165 @@
+# Générateur de classeurs de suivi de parc synthétiques (11 feuilles, noms de colonnes réels) à échelle réglable,
+# pour mesurer le comportement du tableau de bord sur de gros volumes.
+# Exemple : python fleet_synth.py parc_10k.xlsx --vehicules 10000 --carburant 2000000 --kilometrage 2000000
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+DIRECTIONS = ["DAF", "DRH", "DSI", "DG", "DAJ", "DCOM", "DTECH", "DLOG"]
+MARQUES = ["Toyota", "Nissan", "Mitsubishi", "Isuzu", "Hyundai", "Peugeot"]
+TYPES_ENTRETIEN = ["Vidange", "Pneus", "Freins", "Filtres", "Batterie", "Révision générale"]
+PANNES = ["Moteur", "Embrayage", "Électrique", "Suspension", "Boîte de vitesses", "Refroidissement"]
+PRESTATIONS = ["Carrosserie", "Peinture", "Climatisation", "Vitrage", "Remorquage"]
+CARBURANTS = ["Gasoil", "Essence"]
+PRIX_LITRE = {"Gasoil": 4800.0, "Essence": 5200.0}
+ORIGINE_EXCEL = pd.Timestamp("1899-12-30")
+
+# Volumes par défaut : un petit parc ; chaque feuille de mouvements se règle séparément
+DEFAULT_SCALE = {
+    "vehicules": 100,
+    "carburant": 20_000,
+    "kilometrage": 20_000,
+    "entretien": 2_000,
+    "reparations": 1_000,
+    "prestations": 1_000,
+    "achats": 5_000,
+    "fournisseurs": 50,
+}
+
+def vehicle_plates(n):
+    return np.array([f"{1000 + i} T{chr(65 + i // 9000 % 26)}{chr(65 + i // 234000 % 26)}" for i in range(n)], dtype=object)
+
+# Dates tirées uniformément sur la fenêtre [start, start + days[, en numéros de série Excel (jours décimaux exclus)
+def _random_serials(rng, n, start, days):
+    return (start - ORIGINE_EXCEL).days + rng.integers(0, days, n)
+
+def _sorted_by_vehicle(rng, vehicles, n, start, days):
+    owners = np.sort(rng.integers(0, len(vehicles), n))
+    serials = _random_serials(rng, n, start, days)
+    order = np.lexsort((serials, owners))
+    return owners[order], serials[order]
+
+# Construction des colonnes de chaque feuille (tableaux numpy ; dates en numéros de série Excel)
+def build_sheets(scale=None, seed=0, start="2022-01-01", days=1095):
+    scale = {**DEFAULT_SCALE, **(scale or {})}
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(start)
+    plates = vehicle_plates(scale["vehicules"])
+    n_veh = len(plates)
+    fournisseurs = np.array([f"Fournisseur {i + 1}" for i in range(scale["fournisseurs"])], dtype=object)
+    pick = lambda choices, n: np.asarray(choices, dtype=object)[rng.integers(0, len(choices), n)]
+    veh = lambda n: plates[rng.integers(0, n_veh, n)]
+    sheets = {}
+
+    sheets["Parc_Véhicules"] = {
+        "Immatriculation": plates,
+        "Marque": pick(MARQUES, n_veh),
+        "Direction": pick(DIRECTIONS, n_veh),
+        "Prix_Achat": rng.integers(20_000, 180_000, n_veh) * 1000,
+        "Date_Mise_En_Service": _random_serials(rng, n_veh, start - pd.Timedelta(days=3650), 3650),
+        "Année": rng.integers(2008, start.year + 1, n_veh),
+    }
+    n = scale["entretien"]
+    sheets["Entretien"] = {
+        "Immatriculation": veh(n), "Date": _random_serials(rng, n, start, days),
+        "Type_Entretien": pick(TYPES_ENTRETIEN, n), "Coût_Total": rng.integers(50, 2_500, n) * 1000,
+    }
+    n = scale["reparations"]
+    sheets["Réparations Internes"] = {
+        "Immatriculation": veh(n), "Date d_entrée à Andraharo": _random_serials(rng, n, start, days),
+        "Panne": pick(PANNES, n), "Coût_Total": rng.integers(100, 8_000, n) * 1000,
+    }
+    n = scale["prestations"]
+    sheets["Prestation externe"] = {
+        "Immatriculation": veh(n), "Date": _random_serials(rng, n, start, days),
+        "Type de Prestation": pick(PRESTATIONS, n), "Coût_Total": rng.integers(100, 6_000, n) * 1000,
+    }
+    # Relevés kilométriques croissants par véhicule
+    owners, serials = _sorted_by_vehicle(rng, plates, scale["kilometrage"], start, days)
+    steps = rng.integers(20, 600, len(owners))
+    km = pd.Series(steps).groupby(owners).cumsum().to_numpy() + rng.integers(5_000, 250_000, n_veh)[owners]
+    sheets["Suivi_Kilométrage"] = {"Immatriculation": plates[owners], "Date": serials, "Kilométrage": km}
+    sheets["Garage"] = {
+        "Nom_Garage": np.array(["Andraharo", "Garage Externe 1", "Garage Externe 2"], dtype=object),
+        "Adresse": np.array(["Antananarivo"] * 3, dtype=object),
+    }
+    sheets["Fournisseurs"] = {
+        "Nom_du_fournisseur": fournisseurs,
+        "Contact": np.array([f"034 {i:02d} {i * 7 % 1000:03d} 00" for i in range(len(fournisseurs))], dtype=object),
+    }
+    n = scale["achats"]
+    quantites = rng.integers(1, 12, n)
+    prix = rng.integers(5, 400, n) * 500
+    sheets["Achats"] = {
+        "Immatriculation": veh(n), "Date": _random_serials(rng, n, start, days),
+        "Nom_du_fournisseur": fournisseurs[rng.integers(0, len(fournisseurs), n)],
+        "Quantité": quantites, "Prix_Unitaire": prix, "Prix_Total": quantites * prix,
+    }
+    # Deux contrats d'assurance successifs par véhicule (fenêtre d'au moins un jour si la période est courte)
+    debut = np.concatenate([_random_serials(rng, n_veh, start, max(days - 365, 1))] * 2) + np.repeat([0, 365], n_veh)
+    sheets["Assurance"] = {
+        "Immatriculation": np.concatenate([plates, plates]), "Date_Debut": debut, "Date_Fin": debut + 365,
+        "Montant": rng.integers(300, 1_500, 2 * n_veh) * 1000,
+    }
+    sheets["Visite_Technique"] = {
+        "Immatriculation": plates, "Date": _random_serials(rng, n_veh, start, days),
+        "Etat": pick(["Valide", "Valide", "Valide", "Expiré"], n_veh),
+    }
+    owners, serials = _sorted_by_vehicle(rng, plates, scale["carburant"], start, days)
+    types = np.where(rng.random(n_veh) < 0.7, "Gasoil", "Essence").astype(object)[owners]
+    litres = np.round(rng.uniform(15, 75, len(owners)), 1)
+    prix_litre = np.where(types == "Gasoil", PRIX_LITRE["Gasoil"], PRIX_LITRE["Essence"])
+    sheets["Carburant"] = {
+        "Immatriculation": plates[owners], "Date": serials, "Type_Carburant": types,
+        "Litres": litres, "Prix_Litre": prix_litre, "Total_Ar": np.round(litres * prix_litre, 1),
+    }
+    return sheets
+
+# Écriture en flux (xlsxwriter constant_memory) : chaque ligne est écrite puis vidée sur disque ;
+# les colonnes sont converties en listes Python par blocs de lignes pour borner la mémoire
+WRITE_BLOCK_ROWS = 10_000
+
+def write_workbook(path, sheets):
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    date_format = workbook.add_format({"num_format": "dd/mm/yyyy"})
+    for name, columns in sheets.items():
+        worksheet = workbook.add_worksheet(name)
+        headers = list(columns)
+        worksheet.write_row(0, 0, headers)
+        date_cols = [i for i, col in enumerate(headers) if col.startswith("Date")]
+        n_rows = len(columns[headers[0]]) if headers else 0
+        for first in range(0, n_rows, WRITE_BLOCK_ROWS):
+            values = [columns[col][first:first + WRITE_BLOCK_ROWS].tolist() for col in headers]
+            for r, row in enumerate(zip(*values), start=first + 1):
+                worksheet.write_row(r, 0, row)
+                for c in date_cols:
+                    worksheet.write_number(r, c, row[c], date_format)
+    workbook.close()
+
+def generate_workbook(path, scale=None, seed=0, start="2022-01-01", days=1095):
+    sheets = build_sheets(scale, seed, start, days)
+    write_workbook(path, sheets)
+    return {name: len(next(iter(columns.values()))) for name, columns in sheets.items()}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Génère un classeur de suivi de parc synthétique")
+    parser.add_argument("classeur", help="Fichier .xlsx à écrire")
+    for key, value in DEFAULT_SCALE.items():
+        parser.add_argument(f"--{key}", type=int, default=value, help=f"Nombre de lignes (défaut {value})")
+    parser.add_argument("--graine", type=int, default=0, help="Graine du générateur aléatoire")
+    parser.add_argument("--debut", default="2022-01-01", help="Début de la période couverte (AAAA-MM-JJ)")
+    parser.add_argument("--jours", type=int, default=1095, help="Durée de la période couverte en jours")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    scale = {key: getattr(args, key) for key in DEFAULT_SCALE}
+    rows = generate_workbook(args.classeur, scale, args.graine, args.debut, args.jours)
+    for name, count in rows.items():
+        print(f"{name}: {count} lignes")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+# Non-régression du stockage SQLite : les lots de rapports lus dans la base donnent les mêmes coûts par véhicule
+# et les mêmes KPIs de flotte que le chemin en mémoire, y compris quand Parc_Véhicules n'est pas trié ;
+# une feuille Carburant ou Suivi_Kilométrage vide, ou une feuille vierge en plus, ne bloque pas le chargement
+import numpy as np
+import pandas as pd
+import pytest
+import fleet_core
+from fleet_core import (build_cost_cube, cube_for_vehicle, cube_totals, slice_cube, compute_fleet_kpis,
+                        build_fuel_efficiency)
+from fleet_sqlite import (build_sqlite_store, query_batch, query_fleet_kpis, query_efficiency_ranking,
+                          sheet_row_counts)
+
+def _dataset(vehicles):
+    rng = np.random.default_rng(0)
+    dates = pd.to_datetime("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, 40), unit="D")
+    plates = rng.choice(vehicles, 40)
+    parc = pd.DataFrame({"Immatriculation": vehicles, "Direction": ["DG", "DSI"] * (len(vehicles) // 2)})
+    costs = pd.DataFrame({"Immatriculation": plates, "Date": dates, "Coût_Total": rng.integers(1, 100, 40) * 1000.0})
+    return {
+        "Parc_Véhicules": parc,
+        "Entretien": costs.assign(Type_Entretien="Vidange"),
+        "Réparations Internes": costs.rename(columns={"Date": "Date d_entrée à Andraharo"}).assign(Panne="Moteur"),
+        "Prestation externe": costs.assign(**{"Type de Prestation": "Pneus"}),
+        "Suivi_Kilométrage": pd.DataFrame({"Immatriculation": plates, "Date": dates,
+                                           "Kilométrage": rng.integers(1000, 90000, 40).astype(float)}),
+        "Achats": pd.DataFrame({"Immatriculation": plates, "Date": dates, "Nom_du_fournisseur": "F1",
+                                "Prix_Total": rng.integers(1, 50, 40) * 500.0}),
+        "Assurance": pd.DataFrame({"Immatriculation": vehicles, "Date_Fin": pd.Timestamp("2025-06-30")}),
+        "Visite_Technique": pd.DataFrame({"Immatriculation": vehicles, "Etat": "Valide"}),
+        "Carburant": pd.DataFrame({"Immatriculation": plates, "Date": dates, "Type_Carburant": "Gasoil",
+                                   "Litres": rng.integers(10, 60, 40).astype(float),
+                                   "Total_Ar": rng.integers(10, 60, 40) * 5000.0}),
+    }
+
+def test_query_batch_unsorted_parc(tmp_path, monkeypatch):
+    monkeypatch.setattr(fleet_core, "CACHE_DIR", tmp_path)
+    vehicles = ["5678 TBB", "1234 TAA", "9012 TCC", "3456 TAB", "7890 TBA", "2345 TCA"]
+    dfs = _dataset(vehicles)
+    db = build_sqlite_store("test", lambda: dfs)
+    start, end = pd.Timestamp("2024-01-01"), pd.Timestamp("2024-12-31")
+
+    _, cube = query_batch(db, vehicles, start, end)
+    cube_memory = slice_cube(build_cost_cube(dfs), start, end)
+    for vehicle in vehicles:
+        expected = cube_totals(cube_for_vehicle(cube_memory, vehicle))
+        assert cube_totals(cube_for_vehicle(cube, vehicle)) == pytest.approx(expected)
+
+def test_query_fleet_kpis_matches_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(fleet_core, "CACHE_DIR", tmp_path)
+    vehicles = ["5678 TBB", "1234 TAA", "9012 TCC", "3456 TAB"]
+    dfs = _dataset(vehicles)
+    # Relevé sans date : ignoré pour le dernier kilométrage, comme pour le KPI véhicule
+    km = dfs["Suivi_Kilométrage"]
+    dfs["Suivi_Kilométrage"] = pd.concat([km, pd.DataFrame({"Immatriculation": [vehicles[0]], "Date": [pd.NaT],
+                                                            "Kilométrage": [200.0]})], ignore_index=True)
+    db = build_sqlite_store("test", lambda: dfs)
+    start, end = pd.Timestamp("2024-03-01"), pd.Timestamp("2024-10-31")
+
+    expected = compute_fleet_kpis(dfs, start=start, end=end, directions=["DG"])
+    result = query_fleet_kpis(db, start, end, ["DG"])
+    pd.testing.assert_frame_equal(result.sort_values("Immatriculation", ignore_index=True),
+                                  expected.sort_values("Immatriculation", ignore_index=True))
+    vehicle_km = km[km["Immatriculation"] == vehicles[0]].sort_values("Date")["Kilométrage"].iloc[-1]
+    assert expected.set_index("Immatriculation").loc[vehicles[0], "dernier_km"] == vehicle_km
+
+@pytest.mark.parametrize("empty_sheet", ["Carburant", "Suivi_Kilométrage"])
+def test_empty_fuel_or_mileage_sheet(tmp_path, monkeypatch, empty_sheet):
+    monkeypatch.setattr(fleet_core, "CACHE_DIR", tmp_path)
+    vehicles = ["5678 TBB", "1234 TAA"]
+    dfs = _dataset(vehicles)
+    # Feuille avec seulement les en-têtes, telle que relue d'un classeur
+    dfs[empty_sheet] = pd.DataFrame(columns=dfs[empty_sheet].columns, dtype=object)
+    assert build_fuel_efficiency(dfs).empty
+    db = build_sqlite_store("test", lambda: dfs)
+    assert query_efficiency_ranking(db).empty
+
+def test_blank_extra_sheet(tmp_path, monkeypatch):
+    monkeypatch.setattr(fleet_core, "CACHE_DIR", tmp_path)
+    dfs = _dataset(["5678 TBB", "1234 TAA"])
+    dfs["Feuil1"] = pd.DataFrame()
+    db = build_sqlite_store("test", lambda: dfs)
+    assert "Feuil1" not in sheet_row_counts(db)
+    assert sheet_row_counts(db)["Carburant"] == len(dfs["Carburant"])